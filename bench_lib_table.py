@@ -0,0 +1,70 @@
+import argparse
+import random
+import time
+from typing import List
+
+from reload_library import parse_sym_lib_table, format_lib_table
+
+# 合成した巨大な lib-table で parse_sym_lib_table / format_lib_table の速度を測る
+# 使い方: python bench_lib_table.py --sizes 10000 50000 100000
+
+
+def make_table(n: int, seed: int = 0) -> str:
+	rng = random.Random(seed)
+	lines: List[str] = ['(sym_lib_table', '\t(version 7)']
+	for i in range(n):
+		r = rng.random()
+		if r < 0.05:
+			# 古い形式: クォート無しの値
+			lines.append(f'\t(lib (name lib_{i})(type KiCad)(uri ${{KIPRJMOD}}/library/symbols/lib_{i}.kicad_sym)(options "")(descr ""))')
+		elif r < 0.07:
+			# 古い版が Windows で書いた、区切りがバックスラッシュのまま (エスケープされていない) の uri
+			lines.append(f'\t(lib (name "win_{i}")(type "KiCad")(uri "${{KIPRJMOD}}/library\\symbols\\sub\\win_{i}.kicad_sym")(options "")(descr ""))')
+		elif r < 0.10:
+			# 未知のキーやフラグ付き
+			lines.append(f'\t(lib (name "lib_{i}")(type "KiCad")(uri "${{KIPRJMOD}}/library/symbols/lib_{i}.kicad_sym")(options "")(descr "say \\"hi\\"")(disabled)(hidden))')
+		else:
+			lines.append(f'\t(lib (name "lib_{i}")(type "KiCad")(uri "${{KIPRJMOD}}/library/symbols/lib_{i}.kicad_sym")(options "")(descr ""))')
+	lines.append(')')
+	return '\n'.join(lines) + '\n'
+
+
+def bench(n: int, repeat: int) -> None:
+	text = make_table(n)
+
+	best_parse = float('inf')
+	best_format = float('inf')
+	for _ in range(repeat):
+		t0 = time.perf_counter()
+		version, libs = parse_sym_lib_table(text)
+		t1 = time.perf_counter()
+		out = format_lib_table('sym-lib-table', version, libs)
+		t2 = time.perf_counter()
+		best_parse = min(best_parse, t1 - t0)
+		best_format = min(best_format, t2 - t1)
+
+	assert len(libs) == n, f"{len(libs)} != {n}"
+	# 書き戻した内容をもう一度パースしても同じになること
+	assert parse_sym_lib_table(out) == (version, libs)
+	# 知らないエスケープ (\s など) のバックスラッシュが消えないこと
+	for lib in libs:
+		if lib['name'].startswith('win_'):
+			assert lib['uri'] == f"${{KIPRJMOD}}/library\\symbols\\sub\\{lib['name']}.kicad_sym", lib['uri']
+
+	print(f"{n:>8} entries  {len(text)/1e6:7.2f} MB  "
+	      f"parse {best_parse*1e3:8.1f} ms ({best_parse/n*1e6:5.2f} us/entry)  "
+	      f"format {best_format*1e3:8.1f} ms")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='lib-table パーサーのベンチマーク')
+	parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000])
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	for n in args.sizes:
+		bench(n, args.repeat)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,145 @@
+from pathlib import Path
+import argparse
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Optional, Set
+
+from reload_library import MODELS_DIR, path_variables, resolve_path_vars
+from index_library import iter_library_files, parse_footprint
+
+# フットプリントの (model ...) が指す3Dモデルが実在するかを一括チェックする
+# library/models 以下は最初に1回だけ列挙してセットにし、参照ごとの stat はしない
+
+def index_models(models_dir: Path) -> Tuple[Set[str], Dict[str, List[str]]]:
+	"""models_dir 以下の全ファイル (正規化した絶対パス) と、ファイル名ごとの一覧"""
+	files: Set[str] = set()
+	by_name: Dict[str, List[str]] = defaultdict(list)
+	for dirpath, _dirnames, filenames in os.walk(models_dir):
+		for name in filenames:
+			path = _norm(os.path.join(dirpath, name))
+			files.add(path)
+			by_name[os.path.normcase(name)].append(path)
+	return files, by_name
+
+
+def _norm(path: str) -> str:
+	return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+
+def _footprint_models(path: str) -> Tuple[str, List[Tuple[str, str]], Optional[str]]:
+	# プロセスプールから呼ぶ用
+	try:
+		_, models = parse_footprint(path)
+		return path, models, None
+	except (OSError, UnicodeError) as e:
+		return path, [], str(e)
+
+
+@dataclass
+class ModelReport:
+	footprints: int = 0
+	models: int = 0
+	missing: List[Tuple[str, str]] = field(default_factory=list)              # (フットプリント, 参照)
+	unresolved: List[Tuple[str, str, str]] = field(default_factory=list)     # (フットプリント, 参照, 変数名)
+	duplicate_refs: List[Tuple[str, str, int]] = field(default_factory=list) # (フットプリント, 参照, 回数)
+	duplicate_files: List[Tuple[str, List[str]]] = field(default_factory=list)
+	unused: List[str] = field(default_factory=list)
+	errors: List[Tuple[str, str]] = field(default_factory=list)
+
+
+def check_models(project, processes: Optional[int] = None, extra_vars: Optional[Dict[str, str]] = None) -> ModelReport:
+	project = Path(project).resolve()
+	models_dir = project / MODELS_DIR
+
+	# 1. モデルファイルを一度だけ列挙
+	model_files, by_name = index_models(models_dir)
+
+	variables = path_variables(project, extra_vars)
+
+	report = ModelReport(models=len(model_files))
+	used: Set[str] = set()
+	outside_exists: Dict[str, bool] = {}  # library/models の外を指す参照は一意なパスごとに1回だけ stat
+
+	# 2. フットプリントを並列に読んで参照を照合
+	footprints = [str(project / rel) for kind, _lib, rel in iter_library_files(project) if kind == 'footprint']
+	report.footprints = len(footprints)
+	with ProcessPoolExecutor(max_workers=processes) as pool:
+		for path, models, error in pool.map(_footprint_models, footprints, chunksize=32):
+			rel = os.path.relpath(path, project)
+			if error:
+				report.errors.append((rel, error))
+				continue
+
+			counts = Counter(ref for _fp, ref in models)
+			for ref, n in counts.items():
+				if n > 1:
+					report.duplicate_refs.append((rel, ref, n))
+
+			for ref in counts:
+				resolved, var = resolve_path_vars(ref, variables, project)
+				if resolved is None:
+					report.unresolved.append((rel, ref, var))
+					continue
+				if resolved in model_files:
+					used.add(resolved)
+					continue
+				if resolved not in outside_exists:
+					outside_exists[resolved] = os.path.isfile(resolved)
+				if not outside_exists[resolved]:
+					report.missing.append((rel, ref))
+
+	# 3. 同じファイル名のモデルが複数ある / どこからも参照されていない
+	for name, paths in sorted(by_name.items()):
+		if len(paths) > 1:
+			report.duplicate_files.append((name, sorted(os.path.relpath(p, project) for p in paths)))
+	report.unused = sorted(os.path.relpath(p, project) for p in model_files - used)
+	return report
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='フットプリントの3Dモデル参照を検証する')
+	parser.add_argument('-C', '--project', default='.', help='プロジェクトフォルダ (既定: カレント)')
+	parser.add_argument('-p', '--processes', type=int, default=None, help='フットプリント解析に使うプロセス数')
+	parser.add_argument('--var', action='append', default=[], metavar='NAME=VALUE', help='パス変数を追加で定義する (例: KICAD8_3DMODEL_DIR=/usr/share/kicad/3dmodels)')
+	parser.add_argument('--show-unused', action='store_true', help='どこからも参照されていないモデルも表示する')
+	args = parser.parse_args()
+
+	extra_vars = {}
+	for item in args.var:
+		name, sep, value = item.partition('=')
+		if not sep:
+			parser.error(f'--var は NAME=VALUE の形式で指定してください: {item}')
+		extra_vars[name] = value
+
+	start = time.perf_counter()
+	report = check_models(args.project, processes=args.processes, extra_vars=extra_vars)
+
+	for rel, ref in report.missing:
+		print(f"[見つかりません] {rel}: {ref}")
+	for rel, ref, var in report.unresolved:
+		print(f"[未定義の変数 {var}] {rel}: {ref}")
+	for rel, ref, n in report.duplicate_refs:
+		print(f"[重複参照 x{n}] {rel}: {ref}")
+	for name, paths in report.duplicate_files:
+		print(f"[同名モデル] {name}: " + ', '.join(paths))
+	for rel, error in report.errors:
+		print(f"[読み込み失敗] {rel}: {error}")
+	if args.show_unused:
+		for rel in report.unused:
+			print(f"[未使用] {rel}")
+
+	print(f"\nフットプリント {report.footprints} / モデル {report.models}: "
+	      f"見つからない {len(report.missing)} / 未定義の変数 {len(report.unresolved)} / "
+	      f"重複参照 {len(report.duplicate_refs)} / 同名モデル {len(report.duplicate_files)} / "
+	      f"未使用 {len(report.unused)} ({time.perf_counter() - start:.2f} s)")
+
+	if report.missing or report.errors:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,293 @@
+from pathlib import Path
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple, Optional, Iterator
+
+import kicad_sexpr
+from reload_library import FOOTPL_DIR, SYMBOL_DIR, scan_library_dir
+
+# library/symbols の .kicad_sym と library/footprints の .pretty/*.kicad_mod の中身を
+# SQLite に索引化して、シンボル名・フットプリント名・MPN などからすぐ引けるようにする
+
+INDEX_FILE = ".library_index.sqlite"
+INDEX_VERSION = 1
+
+MPN_KEYS = ("MPN", "Manufacturer Part Number", "Manufacturer_Part_Number", "MFR_PN", "MPN#")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+	path TEXT PRIMARY KEY,
+	kind TEXT NOT NULL,
+	library TEXT NOT NULL,
+	mtime_ns INTEGER NOT NULL,
+	size INTEGER NOT NULL,
+	sha1 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parts (
+	file TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+	kind TEXT NOT NULL,
+	library TEXT NOT NULL,
+	name TEXT NOT NULL,
+	value TEXT,
+	footprint TEXT,
+	datasheet TEXT,
+	mpn TEXT,
+	description TEXT
+);
+CREATE TABLE IF NOT EXISTS models (
+	file TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+	footprint TEXT NOT NULL,
+	path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS parts_file ON parts(file);
+CREATE INDEX IF NOT EXISTS parts_name ON parts(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS parts_value ON parts(value COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS parts_mpn ON parts(mpn COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS models_file ON models(file);
+CREATE INDEX IF NOT EXISTS models_path ON models(path);
+"""
+
+Part = Tuple[str, str, Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]  # kind, name, value, footprint, datasheet, mpn, descr
+
+
+def _properties(node: kicad_sexpr.Node) -> Dict[str, str]:
+	props: Dict[str, str] = {}
+	for prop in kicad_sexpr.find_all(node, 'property'):
+		if len(prop) >= 3 and isinstance(prop[1], str) and isinstance(prop[2], str):
+			props.setdefault(prop[1], prop[2])
+	return props
+
+
+def _mpn(props: Dict[str, str]) -> Optional[str]:
+	for key in MPN_KEYS:
+		if props.get(key):
+			return props[key]
+	return None
+
+
+def _atom(node: kicad_sexpr.Node, key: str) -> Optional[str]:
+	child = kicad_sexpr.find(node, key)
+	if child and len(child) > 1 and isinstance(child[1], str):
+		return child[1]
+	return None
+
+
+def parse_symbol_lib(path: str) -> Tuple[List[Part], List[Tuple[str, str]]]:
+	"""(symbol ...) を1つずつ読みながら取り出す。ファイル全体のツリーは作らない"""
+	parts: List[Part] = []
+	with open(path, encoding='utf-8', errors='replace') as f:
+		for node in kicad_sexpr.iter_nodes(f, depth=1):
+			if not node or node[0] != 'symbol' or len(node) < 2 or not isinstance(node[1], str):
+				continue
+			props = _properties(node)
+			parts.append((
+				'symbol', node[1],
+				props.get('Value'), props.get('Footprint'), props.get('Datasheet'),
+				_mpn(props), props.get('Description') or props.get('ki_description'),
+			))
+	return parts, []
+
+
+def parse_footprint(path: str) -> Tuple[List[Part], List[Tuple[str, str]]]:
+	with open(path, encoding='utf-8', errors='replace') as f:
+		root = kicad_sexpr.loads(f.read())
+	if not root or root[0] not in ('footprint', 'module') or len(root) < 2:
+		return [], []
+
+	name = root[1] if isinstance(root[1], str) else Path(path).stem
+	props = _properties(root)
+	# 古い形式は (fp_text value "xxx" ...)
+	for text in kicad_sexpr.find_all(root, 'fp_text'):
+		if len(text) >= 3 and text[1] == 'value' and isinstance(text[2], str):
+			props.setdefault('Value', text[2])
+
+	models = [(name, m[1]) for m in kicad_sexpr.find_all(root, 'model') if len(m) > 1 and isinstance(m[1], str)]
+	part: Part = (
+		'footprint', name,
+		props.get('Value'), None, props.get('Datasheet'),
+		_mpn(props), _atom(root, 'descr') or props.get('Description'),
+	)
+	return [part], models
+
+
+def _parse_file(kind: str, path: str) -> Tuple[List[Part], List[Tuple[str, str]], Optional[str]]:
+	# プロセスプールから呼ぶ用
+	try:
+		if kind == 'symbol':
+			return parse_symbol_lib(path) + (None,)
+		return parse_footprint(path) + (None,)
+	except (OSError, UnicodeError) as e:
+		return [], [], str(e)
+
+
+def _sha1(path: str) -> str:
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			h.update(block)
+	return h.hexdigest()
+
+
+def iter_library_files(project: Path, recursive: bool = True) -> Iterator[Tuple[str, str, str]]:
+	"""(kind, ライブラリ名, プロジェクトからの相対パス) を返す"""
+	manifest: Dict[str, Any] = {'dirs': {}, 'tables': {}}
+	max_depth = None if recursive else 1
+
+	try:
+		symbols, _ = scan_library_dir(Path(SYMBOL_DIR), (".kicad_sym",), manifest, max_depth=max_depth, project_root=project)
+	except FileNotFoundError:
+		symbols = []
+	for rel in symbols:
+		yield 'symbol', Path(rel).stem, (Path(SYMBOL_DIR) / rel).as_posix()
+
+	try:
+		pretties, _ = scan_library_dir(Path(FOOTPL_DIR), (".pretty",), manifest, max_depth=max_depth, project_root=project)
+	except FileNotFoundError:
+		pretties = []
+	for rel in pretties:
+		lib_dir = Path(FOOTPL_DIR) / rel
+		try:
+			with os.scandir(project / lib_dir) as it:
+				names = sorted(item.name for item in it if item.name.endswith('.kicad_mod'))
+		except OSError as e:
+			print(f"ファイルの取得に失敗しました: {e}")
+			continue
+		for name in names:
+			yield 'footprint', Path(rel).stem, (lib_dir / name).as_posix()
+
+
+def open_index(path) -> sqlite3.Connection:
+	con = sqlite3.connect(str(path))
+	con.execute("PRAGMA foreign_keys = ON")
+	con.execute("PRAGMA journal_mode = WAL")
+	con.executescript(SCHEMA)
+	row = con.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+	if row is None or row[0] != str(INDEX_VERSION):
+		con.executescript("DELETE FROM models; DELETE FROM parts; DELETE FROM files;")
+		con.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+		con.commit()
+	return con
+
+
+def update_index(project, recursive: bool = True, processes: Optional[int] = None) -> Dict[str, int]:
+	"""変更のあったファイルだけ読み直して索引を更新する。件数の集計を返す"""
+	project = Path(project)
+	con = open_index(project / INDEX_FILE)
+	known: Dict[str, Tuple[int, int, str]] = {
+		path: (mtime, size, sha1) for path, mtime, size, sha1 in con.execute("SELECT path, mtime_ns, size, sha1 FROM files")
+	}
+	stats = {'unchanged': 0, 'updated': 0, 'removed': 0, 'errors': 0}
+
+	# 1. mtime/サイズ → ハッシュの順に変更を判定
+	todo: List[Tuple[str, str, str, int, int, str]] = []
+	seen = set()
+	for kind, library, rel in iter_library_files(project, recursive):
+		seen.add(rel)
+		try:
+			st = os.stat(project / rel)
+		except OSError:
+			continue
+		old = known.get(rel)
+		if old and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+			stats['unchanged'] += 1
+			continue
+		sha1 = _sha1(str(project / rel))
+		if old and old[2] == sha1:
+			con.execute("UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?", (st.st_mtime_ns, st.st_size, rel))
+			stats['unchanged'] += 1
+			continue
+		todo.append((kind, library, rel, st.st_mtime_ns, st.st_size, sha1))
+
+	# 2. 変更されたファイルを並列に解析
+	with ProcessPoolExecutor(max_workers=processes) as pool:
+		parsed = pool.map(_parse_file, [t[0] for t in todo], [str(project / t[2]) for t in todo], chunksize=16)
+		for (kind, library, rel, mtime, size, sha1), (parts, models, error) in zip(todo, parsed):
+			con.execute("DELETE FROM files WHERE path = ?", (rel,))
+			if error:
+				print(f"ファイルの読み込みに失敗しました: {rel} ({error})")
+				stats['errors'] += 1
+				continue
+			con.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", (rel, kind, library, mtime, size, sha1))
+			con.executemany("INSERT INTO parts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+			                [(rel, p[0], library) + p[1:] for p in parts])
+			con.executemany("INSERT INTO models VALUES (?, ?, ?)", [(rel, fp, path) for fp, path in models])
+			stats['updated'] += 1
+
+	# 3. 消えたファイルを削除
+	removed = [path for path in known if path not in seen]
+	con.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in removed])
+	stats['removed'] = len(removed)
+
+	con.commit()
+	con.close()
+	return stats
+
+
+def search_index(project, pattern: str, kind: Optional[str] = None, limit: int = 50) -> List[sqlite3.Row]:
+	"""名前 / Value / MPN で検索する。* や ? を含む場合はワイルドカード (大文字小文字を区別しない)"""
+	con = open_index(Path(project) / INDEX_FILE)
+	con.row_factory = sqlite3.Row
+
+	if any(c in pattern for c in '*?'):
+		like = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('*', '%').replace('?', '_')
+		cond = "(name LIKE :p ESCAPE '\\' OR value LIKE :p ESCAPE '\\' OR mpn LIKE :p ESCAPE '\\')"
+		params: Dict[str, Any] = {'p': like}
+	else:
+		cond = "(name = :p COLLATE NOCASE OR value = :p COLLATE NOCASE OR mpn = :p COLLATE NOCASE)"
+		params = {'p': pattern}
+	if kind:
+		cond += " AND parts.kind = :kind"
+		params['kind'] = kind
+
+	rows = con.execute(
+		f"""SELECT parts.*, group_concat(DISTINCT models.path) AS models
+		FROM parts LEFT JOIN models ON models.file = parts.file AND models.footprint = parts.name
+		WHERE {cond} GROUP BY parts.rowid ORDER BY parts.kind, parts.library, parts.name LIMIT :limit""",
+		dict(params, limit=limit)
+	).fetchall()
+	con.close()
+	return rows
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='シンボル/フットプリントの中身を SQLite に索引化して検索する')
+	parser.add_argument('-C', '--project', default='.', help='プロジェクトフォルダ (既定: カレント)')
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	p_update = sub.add_parser('update', help='索引を作成/更新する (変更されたファイルのみ読み直す)')
+	p_update.add_argument('--no-recursive', action='store_true', help='library/symbols, library/footprints の直下だけを見る')
+	p_update.add_argument('-p', '--processes', type=int, default=None, help='解析に使うプロセス数')
+
+	p_search = sub.add_parser('search', help='名前 / Value / MPN で検索する (* ? が使える)')
+	p_search.add_argument('pattern')
+	p_search.add_argument('--kind', choices=['symbol', 'footprint'])
+	p_search.add_argument('--limit', type=int, default=50)
+	args = parser.parse_args()
+
+	if args.command == 'update':
+		start = time.perf_counter()
+		stats = update_index(args.project, recursive=not args.no_recursive, processes=args.processes)
+		print(f"更新 {stats['updated']} / 変更なし {stats['unchanged']} / 削除 {stats['removed']} / エラー {stats['errors']}"
+		      f" ({time.perf_counter() - start:.2f} s)")
+		if stats['errors']:
+			sys.exit(2)
+	else:
+		start = time.perf_counter()
+		rows = search_index(args.project, args.pattern, kind=args.kind, limit=args.limit)
+		for r in rows:
+			print(f"{r['kind']:9} {r['library']}:{r['name']}")
+			for label, key in (("Value", 'value'), ("Footprint", 'footprint'), ("MPN", 'mpn'), ("Datasheet", 'datasheet'), ("3D", 'models')):
+				if r[key]:
+					print(f"\t{label}: {r[key]}")
+			print(f"\t{r['file']}")
+		print(f"{len(rows)} 件 ({(time.perf_counter() - start)*1e3:.1f} ms)")
+
+
+if __name__ == "__main__":
+	main()
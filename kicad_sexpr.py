@@ -0,0 +1,108 @@
+import re
+from typing import Any, Iterable, Iterator, List, Optional
+
+# KiCadのS式 (lib-table / .kicad_sym / .kicad_mod / .kicad_sch) 用の簡易パーサー
+# 正規表現はトークン単位でのみ使うので、入力長に対して線形時間で処理できる
+
+Node = List[Any]
+
+_TOKEN_RE = re.compile(
+	r'(\()'                          # グループ1: (
+	r'|(\))'                         # グループ2: )
+	r'|"((?:[^"\\]|\\.)*)"?'         # グループ3: "文字列" (閉じ忘れも許容)
+	r'|([^\s()"]+)',                 # グループ4: クォート無しのアトム
+	re.S
+)
+
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '"': '"', '\\': '\\'}
+_UNESCAPE_RE = re.compile(r'\\(.)', re.S)
+
+
+def unescape(s: str) -> str:
+	if '\\' not in s:
+		return s
+	# 知らないエスケープはバックスラッシュごと残す (古い版が書いた Windows のパス "library\footprints" など)
+	return _UNESCAPE_RE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(0)), s)
+
+
+def quote(s: str) -> str:
+	return '"' + s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+class _Builder:
+	"""トークンを受け取りながらノードを組み立てる (行単位のストリーミング用)"""
+
+	def __init__(self, yield_depth: int = 0):
+		self.stack: List[Node] = []
+		self.yield_depth = yield_depth
+		self.done: List[Node] = []
+
+	def feed(self, text: str) -> None:
+		stack = self.stack
+		for m in _TOKEN_RE.finditer(text):
+			kind = m.lastindex
+			if kind == 1:
+				stack.append([])
+			elif kind == 2:
+				if stack:  # 余分な ) は無視
+					self._close()
+			elif stack:
+				stack[-1].append(unescape(m.group(3)) if kind == 3 else m.group(4))
+
+	def _close(self) -> None:
+		node = self.stack.pop()
+		if len(self.stack) == self.yield_depth:
+			self.done.append(node)
+		elif self.stack:
+			self.stack[-1].append(node)
+
+	def finish(self) -> None:
+		# 閉じ括弧が足りない場合は末尾で閉じる
+		while self.stack:
+			self._close()
+
+
+def loads(text: str) -> Node:
+	"""最初のトップレベルのリストを返す。見つからなければ空リスト"""
+	builder = _Builder()
+	builder.feed(text)
+	builder.finish()
+	return builder.done[0] if builder.done else []
+
+
+def iter_nodes(lines: Iterable[str], depth: int = 1) -> Iterator[Node]:
+	"""指定した深さのノードを、読み込みながら順に返す
+
+	depth=1 ならルート直下の子 (例: .kicad_sym の各 (symbol ...)) 。
+	メモリ使用量は最大のノード1つ分に収まる。
+	"""
+	builder = _Builder(yield_depth=depth)
+	for line in lines:
+		builder.feed(line)
+		if builder.done:
+			yield from builder.done
+			builder.done.clear()
+	builder.finish()
+	yield from builder.done
+
+
+def find(node: Node, key: str) -> Optional[Node]:
+	for child in node:
+		if isinstance(child, list) and child and child[0] == key:
+			return child
+	return None
+
+
+def find_all(node: Node, key: str) -> Iterator[Node]:
+	for child in node:
+		if isinstance(child, list) and child and child[0] == key:
+			yield child
+
+
+def dumps(node: Any) -> str:
+	if isinstance(node, list):
+		if not node:
+			return '()'
+		head, rest = node[0], node[1:]
+		return '(' + ' '.join([head if isinstance(head, str) else dumps(head)] + [dumps(x) for x in rest]) + ')'
+	return quote(str(node))
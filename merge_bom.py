@@ -1,9 +1,15 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinterdnd2 import DND_FILES, TkinterDnD
-import pandas as pd
 import os
+import queue
 import re
+import threading
+import time
+
+from merge_bom_engine import (AggregateStore, KeyNormalize, MergeCancelled, ParsedFileCache, common_columns,
+                              detect_encoding, expand_inputs, incompatible_files, merge_files, read_header,
+                              read_headers, write_result)
 
 class AutoSelectCSVMergerApp(TkinterDnD.Tk):
     def __init__(self):
@@ -14,6 +20,18 @@ class AutoSelectCSVMergerApp(TkinterDnD.Tk):
         self.configure(bg="#f0f0f0")
         
         self.file_paths = []
+        self.path_set = set()  # 重複チェック用 (正規化したパス)
+        self.encodings = {}  # path -> 判定済みの文字コード
+        self.headers = {}  # path -> (文字コード, 列名リスト, エラー)。ドロップ直後にバックグラウンドで読む
+        self.header_pending = set()
+        self.header_queue = queue.Queue()
+        self.cache = ParsedFileCache()  # 同じファイルを何度もパースしないためのキャッシュ
+
+        # バックグラウンドのマージ処理の状態
+        self.merge_thread = None
+        self.merge_queue = queue.Queue()
+        self.merge_cancel = threading.Event()
+        self.merge_started = 0.0
 
         # ==========================================
         # 【ここをカスタマイズ】自動選択のキーワード設定
@@ -22,7 +40,7 @@ class AutoSelectCSVMergerApp(TkinterDnD.Tk):
         self.key_keywords = [
             "型番", "品番", "商品コード", "JAN", "SKU", 
             "ItemCode", "Product ID", "ID", "コード", 
-            "product", "digikey"
+            "product", "digikey", "MPN"
         ]
         
         # 数量（集計列）とみなすキーワードのリスト
@@ -48,8 +66,28 @@ class AutoSelectCSVMergerApp(TkinterDnD.Tk):
         self.combo_key = ttk.Combobox(frame_top, width=20, state="readonly")
         self.combo_key.grid(row=0, column=3, padx=5)
 
+        # 列を選び直したら、その列が無いファイルを表示し直す
+        self.combo_val.bind("<<ComboboxSelected>>", lambda e: self.flag_files())
+        self.combo_key.bind("<<ComboboxSelected>>", lambda e: self.flag_files())
+
+        # 読み込み/保存のオプション
+        self.var_pyarrow = tk.BooleanVar(value=False)
+        tk.Checkbutton(frame_top, text="pyarrowで高速読み込み", variable=self.var_pyarrow,
+                       bg="#f0f0f0").grid(row=1, column=0, columnspan=2, sticky="w", padx=(10,0), pady=(5,0))
+        self.var_parquet = tk.BooleanVar(value=False)
+        tk.Checkbutton(frame_top, text="Parquetも保存", variable=self.var_parquet,
+                       bg="#f0f0f0").grid(row=1, column=2, columnspan=2, sticky="w", pady=(5,0))
+
+        # 型番の正規化 (全角/半角、前後の空白、大文字小文字をそろえ、正規表現に一致する部分を除く)
+        self.var_normalize = tk.BooleanVar(value=False)
+        tk.Checkbutton(frame_top, text="型番を正規化", variable=self.var_normalize,
+                       bg="#f0f0f0").grid(row=2, column=0, columnspan=2, sticky="w", padx=(10,0), pady=(5,0))
+        tk.Label(frame_top, text="除去する正規表現:", bg="#f0f0f0").grid(row=2, column=2, sticky="w", pady=(5,0))
+        self.entry_key_regex = tk.Entry(frame_top, width=22)
+        self.entry_key_regex.grid(row=2, column=3, padx=5, pady=(5,0))
+
         # 2. 説明とリストエリア
-        tk.Label(self, text="CSVファイルをリストにドロップしてください。\n(キーワードに一致する列を自動選択します)", bg="#f0f0f0").pack(pady=(5, 0))
+        tk.Label(self, text="CSV / Parquet / Feather / KiCad回路図 (.kicad_sch) をリストにドロップしてください。\n(キーワードに一致する列を自動選択します)", bg="#f0f0f0").pack(pady=(5, 0))
 
         frame_list = tk.Frame(self)
         frame_list.pack(pady=5, padx=20, fill='both', expand=True)
@@ -72,50 +110,112 @@ class AutoSelectCSVMergerApp(TkinterDnD.Tk):
         btn_clear = tk.Button(frame_btn, text="リストをクリア", command=self.clear_list, bg="#6c757d", fg="white")
         btn_clear.pack(side=tk.LEFT, padx=10)
 
-        btn_run = tk.Button(frame_btn, text="マージして保存", command=self.run_merge, 
+        self.btn_run = tk.Button(frame_btn, text="マージして保存", command=self.run_merge, 
                             bg="#007bff", fg="white", font=("Meiryo", 12, "bold"), width=20)
-        btn_run.pack(side=tk.LEFT, padx=10)
+        self.btn_run.pack(side=tk.LEFT, padx=10)
+
+        # 累計ファイル (SQLite) に未取り込みのファイルだけを足し込む
+        self.btn_store = tk.Button(frame_btn, text="累計に追加", command=self.run_store, bg="#28a745", fg="white")
+        self.btn_store.pack(side=tk.LEFT, padx=10)
+
+        self.btn_cancel = tk.Button(frame_btn, text="中止", command=self.cancel_merge, state=tk.DISABLED,
+                                    bg="#dc3545", fg="white")
+        self.btn_cancel.pack(side=tk.LEFT, padx=10)
         
         self.lbl_status = tk.Label(self, text="待機中...", bg="#ddd", anchor="w")
         self.lbl_status.pack(side=tk.BOTTOM, fill='x')
 
-    def read_csv_auto_enc(self, path):
-        """文字コード自動判別読み込み"""
+    def encoding_of(self, path):
+        """文字コードはファイルごとに一度だけ先頭バイトから判定して使い回す"""
+        if path not in self.encodings:
+            self.encodings[path] = detect_encoding(path)
+        return self.encodings[path]
+
+    def read_columns(self, path):
+        """ヘッダー行だけを読む"""
         try:
-            return pd.read_csv(path, encoding='utf-8')
-        except UnicodeDecodeError:
-            try:
-                return pd.read_csv(path, encoding='cp932')
-            except Exception:
-                return None
+            return read_header(path, self.encoding_of(path), cache=self.cache)
         except Exception:
             return None
 
     def drop_handler(self, event):
-        """ファイルを解析してリスト追加＆ヘッダー取得"""
-        data = event.data
-        paths = re.findall(r'\{.*?\}|\S+', data)
-        
-        added_count = 0
-        for path in paths:
-            clean_path = path.strip('{}')
-            if clean_path not in self.file_paths:
-                self.file_paths.append(clean_path)
-                self.listbox.insert(tk.END, os.path.basename(clean_path))
-                added_count += 1
-        
-        # ファイルが追加されたら、最初のファイルの列情報を取得してコンボボックスを更新
-        if self.file_paths:
-            self.update_column_options(self.file_paths[0])
+        """ファイルを解析してリスト追加＆ヘッダー取得 (フォルダは中のファイルを再帰的に追加)"""
+        start = time.perf_counter()
+        paths = self.tk.splitlist(event.data)
+        added = expand_inputs(paths, self.path_set)
+        if added:
+            first = len(self.file_paths)
+            self.file_paths.extend(added)
+            # 1件ずつではなくまとめて挿入する (数千件でも1回のTcl呼び出し)
+            self.listbox.insert(tk.END, *(os.path.basename(p) for p in added))
+            for i in range(first, len(self.file_paths)):
+                self.listbox.itemconfig(i, fg="gray")  # ヘッダー確認中
+
+        # 追加したファイルのヘッダーを並列に読み、結果が揃ったら列の候補と表示を更新
+        if added:
+            self.start_header_check(added)
+
+        self.lbl_status.config(text=f"{len(added)} ファイル追加 (合計: {len(self.file_paths)}, "
+                                    f"{time.perf_counter() - start:.2f} 秒)")
+
+    def start_header_check(self, paths):
+        running = bool(self.header_pending)
+        self.header_pending.update(paths)
+
+        def worker(q=self.header_queue):
+            q.put(read_headers(paths, cache=self.cache))
+
+        threading.Thread(target=worker, daemon=True).start()
+        if not running:
+            self.after(100, self.poll_headers)
+
+    def poll_headers(self):
+        while True:
+            try:
+                headers = self.header_queue.get_nowait()
+            except queue.Empty:
+                break
+            for path, info in headers.items():
+                # クリアされた後に届いた結果は捨てる
+                if path in self.header_pending:
+                    self.header_pending.discard(path)
+                    self.headers[path] = info
+                    if info[0] is not None:
+                        self.encodings[path] = info[0]
+
+        if self.header_pending:
+            self.after(100, self.poll_headers)
+            return
+        self.update_column_options()
+        self.flag_files()
 
-        self.lbl_status.config(text=f"{added_count} ファイル追加 (合計: {len(self.file_paths)})")
+    def flag_files(self):
+        """基準列/集計列が無いファイルを赤く表示する"""
+        key_col = self.combo_key.get()
+        val_col = self.combo_val.get()
+        headers = {p: self.headers[p] for p in self.file_paths if p in self.headers}
+        bad = dict(incompatible_files(headers, key_col, val_col))
+        for i, path in enumerate(self.file_paths):
+            if path not in self.headers:
+                color = "gray"
+            elif path in bad:
+                color = "red"
+            else:
+                color = "black"
+            self.listbox.itemconfig(i, fg=color)
+        if bad:
+            self.lbl_status.config(text=f"{len(bad)} ファイルに選択中の列がありません (赤字)")
+        return bad
+
+    def update_column_options(self):
+        """全ファイルのヘッダーに共通する列から、キーワードにマッチするものを自動選択"""
+        headers = {p: self.headers[p] for p in self.file_paths if p in self.headers}
+        columns = common_columns(headers)
+        if not columns and self.file_paths:
+            # 共通の列が無い場合は最初のファイルの列を候補にする (合わないファイルは赤字になる)
+            columns = self.read_columns(self.file_paths[0])
+        if columns is not None:
 
-    def update_column_options(self, file_path):
-        """CSVヘッダーを読み取り、キーワードにマッチするものを自動選択"""
-        df = self.read_csv_auto_enc(file_path)
-        if df is not None:
-            columns = df.columns.tolist()
-            
             # コンボボックスの選択肢を更新
             self.combo_key['values'] = columns
             self.combo_val['values'] = columns
@@ -164,6 +264,10 @@ class AutoSelectCSVMergerApp(TkinterDnD.Tk):
 
     def clear_list(self):
         self.file_paths = []
+        self.path_set = set()
+        self.encodings = {}
+        self.headers = {}
+        self.header_pending = set()
         self.listbox.delete(0, tk.END)
         self.combo_key.set('')
         self.combo_val.set('')
@@ -171,7 +275,23 @@ class AutoSelectCSVMergerApp(TkinterDnD.Tk):
         self.combo_val['values'] = []
         self.lbl_status.config(text="リストをクリアしました")
 
-    def run_merge(self):
+    def run_store(self):
+        if self.merge_thread is not None or not self.file_paths:
+            return self.run_merge()
+        store_path = filedialog.asksaveasfilename(
+            defaultextension=".sqlite",
+            filetypes=[("累計ファイル", "*.sqlite"), ("All Files", "*.*")],
+            title="累計ファイルを選択 (無ければ新規作成)",
+            initialfile="bom_total.sqlite",
+            confirmoverwrite=False
+        )
+        if store_path:
+            self.run_merge(store_path)
+
+    def run_merge(self, store_path=None):
+        if self.merge_thread is not None:
+            return
+
         if not self.file_paths:
             messagebox.showwarning("警告", "CSVファイルを追加してください。")
             return
@@ -183,37 +303,123 @@ class AutoSelectCSVMergerApp(TkinterDnD.Tk):
             messagebox.showwarning("警告", "基準列と集計列を選択してください。")
             return
 
-        try:
-            self.lbl_status.config(text="処理中...")
-            self.update()
-
-            df_list = []
-            for path in self.file_paths:
-                df = self.read_csv_auto_enc(path)
-                if df is None:
-                    raise ValueError(f"ファイル読み込みエラー: {os.path.basename(path)}")
-                
-                if key_col not in df.columns or val_col not in df.columns:
-                    raise ValueError(f"ファイル「{os.path.basename(path)}」に\n指定された列が見つかりません。")
-                
-                df_list.append(df)
+        if self.header_pending:
+            messagebox.showwarning("警告", "ヘッダーを確認中です。少し待ってから実行してください。")
+            return
 
-            # 結合
-            df_concat = pd.concat(df_list, ignore_index=True)
-            
-            # 集計
-            df_merged = df_concat.groupby(key_col, as_index=False)[val_col].sum()
+        normalize = None
+        if self.var_normalize.get():
+            pattern = self.entry_key_regex.get().strip() or None
+            if pattern:
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    messagebox.showwarning("警告", f"正規表現が正しくありません。\n{e}")
+                    return
+            normalize = KeyNormalize(pattern=pattern)
+
+        # 列が合わないファイルがあれば何も読まずに止める
+        bad = self.flag_files()
+        if bad:
+            names = "\n".join(os.path.basename(p) for p in list(bad)[:10])
+            messagebox.showwarning("警告", f"{len(bad)} ファイルに選択中の列がありません。\n{names}")
+            return
+
+        # 読み込みと集計はワーカープロセスで行い、画面は止めない
+        paths = list(self.file_paths)
+        encodings = {p: self.encodings[p] for p in paths if p in self.encodings}
+        engine = 'pyarrow' if self.var_pyarrow.get() else 'c'
+        self.merge_queue = queue.Queue()
+        self.merge_cancel = threading.Event()
+        self.merge_started = time.perf_counter()
+
+        def worker(q=self.merge_queue, cancel=self.merge_cancel):
+            try:
+                # 基準列/集計列だけをチャンクで読み込んで集計
+                options = dict(encodings=encodings, workers=None, cancel=cancel, cache=self.cache, engine=engine,
+                               progress=lambda *args: q.put(("progress", args)))
+                if store_path:
+                    with AggregateStore(store_path, key_col, val_col, normalize) as store:
+                        added, skipped = store.add_files(paths, **options)
+                        q.put(("stored", (added, skipped)))
+                        invalid_values = store.invalid_values
+                        df = store.to_frame()
+                else:
+                    df = merge_files(paths, key_col, val_col, normalize=normalize, **options)
+                    invalid_values = df.attrs['invalid_values']
+                q.put(("done", (df, invalid_values)))
+            except MergeCancelled:
+                q.put(("cancelled", None))
+            except Exception as e:
+                q.put(("error", e))
+
+        self.btn_run.config(state=tk.DISABLED)
+        self.btn_store.config(state=tk.DISABLED)
+        self.btn_cancel.config(state=tk.NORMAL)
+        self.lbl_status.config(text=f"処理中... 0/{len(paths)} ファイル")
+        self.merge_thread = threading.Thread(target=worker, daemon=True)
+        self.merge_thread.start()
+        self.after(100, self.poll_merge)
+
+    def cancel_merge(self):
+        if self.merge_thread is not None:
+            self.merge_cancel.set()
+            self.btn_cancel.config(state=tk.DISABLED)
+            self.lbl_status.config(text="中止しています...")
+
+    def poll_merge(self):
+        """ワーカーからの進捗をTkのイベントループ上で反映する"""
+        result = None
+        while True:
+            try:
+                kind, payload = self.merge_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                done, total, _path, rows = payload
+                if not self.merge_cancel.is_set():
+                    rate = rows / max(time.perf_counter() - self.merge_started, 1e-9)
+                    self.lbl_status.config(text=f"処理中... {done}/{total} ファイル  {rows:,} 行  ({rate:,.0f} 行/秒)")
+            elif kind == "stored":
+                added, skipped = payload
+                self.lbl_status.config(text=f"累計に追加: {added} ファイル (取り込み済み {skipped} ファイル)")
+            else:
+                result = (kind, payload)
+
+        if result is None:
+            self.after(100, self.poll_merge)
+            return
+
+        self.merge_thread = None
+        self.btn_run.config(state=tk.NORMAL)
+        self.btn_store.config(state=tk.NORMAL)
+        self.btn_cancel.config(state=tk.DISABLED)
 
+        kind, payload = result
+        if kind == "cancelled":
+            self.lbl_status.config(text="中止しました")
+        elif kind == "error":
+            self.lbl_status.config(text="エラー発生")
+            messagebox.showerror("エラー", str(payload))
+        else:
+            df, invalid_values = payload
+            if invalid_values:
+                names = "\n".join(f"{os.path.basename(p)}: {n} 個" for p, n in list(invalid_values.items())[:10])
+                messagebox.showwarning("警告", f"集計列に数値にできない値があり、0 として数えました。\n{names}")
+            self.save_result(df)
+
+    def save_result(self, df_merged):
+        try:
             save_path = filedialog.asksaveasfilename(
                 defaultextension=".csv",
-                filetypes=[("CSV Files", "*.csv")],
+                filetypes=[("CSV Files", "*.csv"), ("Parquet Files", "*.parquet")],
                 title="保存先を選択",
                 initialfile="merged_result.csv"
             )
 
             if save_path:
-                df_merged.to_csv(save_path, index=False, encoding='utf-8-sig')
-                self.lbl_status.config(text="完了しました")
+                saved = write_result(df_merged, save_path, parquet=self.var_parquet.get())
+                self.lbl_status.config(text="完了しました: " + ", ".join(os.path.basename(p) for p in saved))
                 messagebox.showinfo("成功", f"マージ完了！\n合計 {len(df_merged)} 行のデータを作成しました。")
             else:
                 self.lbl_status.config(text="キャンセルされました")
@@ -0,0 +1,815 @@
+import argparse
+import codecs
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from schematic_bom import schematic_bom
+
+# merge_bom.py のマージ処理 (GUIなしでも使えるように分離)
+# CSVは基準列/集計列だけをチャンクで読み、型番ごとの合計に畳み込んでいく。
+# メモリ使用量は総行数ではなく型番の種類数に比例する。
+
+ENCODINGS = ('utf-8', 'cp932')
+CHUNK_ROWS = 200_000
+SAMPLE_BYTES = 64 * 1024
+CACHE_BYTES = 512 * 1024 * 1024
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+INPUT_ENGINES = ('c', 'pyarrow')
+HEADER_THREADS = 8
+SCHEMATIC_SUFFIX = '.kicad_sch'
+INPUT_SUFFIXES = ('.csv', SCHEMATIC_SUFFIX) + tuple(COLUMNAR_FORMATS)
+
+
+def file_format(path):
+    """拡張子から 'csv' / 'parquet' / 'feather' / 'kicad_sch' を返す"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == SCHEMATIC_SUFFIX:
+        return 'kicad_sch'
+    return COLUMNAR_FORMATS.get(ext, 'csv')
+
+
+def _is_input(path):
+    # 回路図はプロジェクトのルートシート (同名の .kicad_pro がある) だけを拾う。
+    # サブシートはルートから辿るので、フォルダごと渡しても二重には数えない
+    lower = path.lower()
+    if lower.endswith(SCHEMATIC_SUFFIX):
+        return os.path.exists(path[:-len(SCHEMATIC_SUFFIX)] + '.kicad_pro')
+    return lower.endswith(INPUT_SUFFIXES)
+
+
+def _walk_inputs(folder):
+    # os.walk より軽い scandir で再帰的に列挙する (名前順)
+    try:
+        entries = sorted(os.scandir(folder), key=lambda e: e.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir():
+            yield from _walk_inputs(entry.path)
+        elif _is_input(entry.path):
+            yield entry.path
+
+
+def normalize_path(path):
+    """重複判定用のパス (絶対パス + 大文字小文字の正規化)"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def expand_inputs(items, seen=None):
+    """ファイル/フォルダ/ワイルドカードの指定を入力ファイルのリストに展開する
+
+    フォルダは再帰的に CSV / Parquet / Feather / ルート回路図を探す。ワイルドカードは ** も使える。
+    seen (正規化済みパスのセット) に含まれるものは除き、追加したものは seen に足す。
+    """
+    if seen is None:
+        seen = set()
+    result = []
+
+    def add(path):
+        norm = normalize_path(path)
+        if norm not in seen:
+            seen.add(norm)
+            result.append(path)
+
+    for item in items:
+        if os.path.isdir(item):
+            for path in _walk_inputs(item):
+                add(path)
+        elif glob.has_magic(item) and not os.path.exists(item):
+            for path in sorted(glob.glob(item, recursive=True)):
+                if os.path.isdir(path):
+                    for sub in _walk_inputs(path):
+                        add(sub)
+                elif _is_input(path):
+                    add(path)
+        else:
+            add(item)  # 存在しないファイルは読み込み時にエラーとして報告する
+    return result
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ValueError("Parquet/Feather と pyarrow エンジンには pyarrow が必要です (pip install pyarrow)")
+
+
+def detect_encoding(path, sample_bytes=SAMPLE_BYTES):
+    """先頭のバイト列だけを見て文字コードを決める (ファイル全体はパースしない)
+
+    Parquet/Feather は文字コードが無いので None を返す。
+    """
+    if file_format(path) != 'csv':
+        return None
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    for enc in ENCODINGS:
+        try:
+            # サンプル末尾で多バイト文字が切れていてもエラーにしない
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return ENCODINGS[-1]
+
+
+def _estimate_bytes(value):
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_estimate_bytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ParsedFileCache:
+    """解析結果のLRUキャッシュ (パス+サイズ+mtime+文字コードがキー、メモリ上限付き)
+
+    同じファイルリストで何度もマージする時に、ディスクの読み込みとパースを丸ごと省く。
+    ファイルが更新されるとサイズかmtimeが変わるので自動的に読み直しになる。
+    put() に deps (他に読んだファイルのパス) を渡すと、それらのどれかが変わった場合も読み直しになる
+    (.kicad_sch のサブシートだけ編集された場合など)。
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def file_key(path, encoding):
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_size, st.st_mtime_ns, encoding)
+
+    @staticmethod
+    def _dep_changed(deps):
+        for path, size, mtime_ns in deps:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return True
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                return True
+        return False
+
+    def get(self, file_key, what):
+        with self._lock:
+            item = self._items.get((file_key, what))
+            if item is not None and self._dep_changed(item[2]):
+                self._bytes -= item[1]
+                del self._items[(file_key, what)]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end((file_key, what))
+            self.hits += 1
+            return item[0]
+
+    def put(self, file_key, what, value, deps=()):
+        size = _estimate_bytes(value)
+        if size > self.max_bytes:
+            return
+        dep_stats = []
+        for path in deps:
+            st = os.stat(path)
+            dep_stats.append((path, st.st_size, st.st_mtime_ns))
+        with self._lock:
+            old = self._items.pop((file_key, what), None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[(file_key, what)] = (value, size, tuple(dep_stats))
+            self._bytes += size
+            # 古いものから捨てて上限に収める
+            while self._bytes > self.max_bytes and self._items:
+                _, (_, old_size, _) = self._items.popitem(last=False)
+                self._bytes -= old_size
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+def read_schematic(path, cache=None, executor=None):
+    """.kicad_sch の階層を展開して (列名, 行のリスト) を返す
+
+    cache を渡すと結果を保存し、ルートとサブシートのどれも変わっていなければ解析を省く。
+    ヘッダーの確認と集計で同じ解析結果を使うため。
+    executor (プロセスプール) を渡すとシートファイルを並列に解析する。省略時はこのプロセスで解析する。
+    """
+    if cache is None:
+        return schematic_bom(path, executor)[:2]
+    file_key = cache.file_key(path, None)
+    hit = cache.get(file_key, ('schematic',))
+    if hit is not None:
+        return hit
+    columns, rows, sheets = schematic_bom(path, executor)
+    cache.put(file_key, ('schematic',), (columns, rows), deps=sheets)
+    return columns, rows
+
+
+def _read_columns(path, encoding):
+    fmt = file_format(path)
+    if fmt == 'kicad_sch':
+        return read_schematic(path)[0]
+    if fmt == 'parquet':
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(path).names)
+    if fmt == 'feather':
+        _require_pyarrow()
+        import pyarrow.ipc as ipc
+        with ipc.open_file(path) as reader:
+            return list(reader.schema.names)
+    return pd.read_csv(path, encoding=encoding, nrows=0).columns.tolist()
+
+
+def read_header(path, encoding=None, cache=None, executor=None):
+    """ヘッダー行 (Parquet/Feather はスキーマ) だけを読んで列名のリストを返す
+
+    executor は .kicad_sch の解析用 (read_schematic() と同じ)。
+    """
+    if encoding is None:
+        encoding = detect_encoding(path)
+    if file_format(path) == 'kicad_sch':
+        # 列名だけをキャッシュするとサブシートの変更に気づけないので、解析結果ごとキャッシュする
+        return list(read_schematic(path, cache, executor)[0])
+    if cache is not None:
+        file_key = cache.file_key(path, encoding)
+        columns = cache.get(file_key, ('header',))
+        if columns is None:
+            columns = _read_columns(path, encoding)
+            cache.put(file_key, ('header',), columns)
+        return list(columns)
+    return _read_columns(path, encoding)
+
+
+def _read_header_safe(path, encoding, cache, executor):
+    try:
+        if encoding is None:
+            encoding = detect_encoding(path)
+        return encoding, read_header(path, encoding, cache, executor), None
+    except Exception as e:
+        return encoding, None, str(e)
+
+
+def read_headers(paths, encodings=None, cache=None, workers=HEADER_THREADS, executor=None):
+    """複数ファイルのヘッダーだけを並列に読む
+
+    戻り値は {path: (文字コード, 列名リスト, エラー)}。読めなかったファイルは列名リストが None。
+    ヘッダーの読み込みは I/O 待ちがほとんどなのでスレッドで並べる。
+    executor を渡すと .kicad_sch のシートの解析はそのプロセスプールで行う (全ファイルで共有する)。
+    """
+    encodings = encodings or {}
+    if len(paths) <= 1 or workers == 1:
+        return {p: _read_header_safe(p, encodings.get(p), cache, executor) for p in paths}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda p: _read_header_safe(p, encodings.get(p), cache, executor), paths)
+        return dict(zip(paths, results))
+
+
+def incompatible_files(headers, key_col, val_col):
+    """基準列/集計列が無い (または読めない) ファイルを [(path, 理由)] で返す"""
+    result = []
+    for path, (_enc, columns, error) in headers.items():
+        if columns is None:
+            result.append((path, error or "読み込めません"))
+            continue
+        missing = [c for c in (key_col, val_col) if c not in columns]
+        if missing:
+            result.append((path, "列がありません: " + ", ".join(missing)))
+    return result
+
+
+def common_columns(headers):
+    """読めた全ファイルに共通する列名 (最初のファイルの列順)"""
+    columns = None
+    shared = None
+    for _enc, cols, _error in headers.values():
+        if cols is None:
+            continue
+        if columns is None:
+            columns, shared = cols, set(cols)
+        else:
+            shared &= set(cols)
+    return [c for c in columns if c in shared] if columns else []
+
+
+def _encodings_to_try(encoding):
+    # 判定した文字コードで読み、サンプルより後ろで失敗した場合だけ他を試す
+    if encoding is None:
+        return ENCODINGS
+    return (encoding,) + tuple(e for e in ENCODINGS if e != encoding)
+
+
+class MergeCancelled(Exception):
+    """merge_files() が cancel で中断された"""
+
+
+# 型番の正規化 (例: "ＬＭ３５８ " と "lm358" を同じ型番として数える)
+#   nfkc:    全角英数/記号を半角に、半角カナを全角にそろえる
+#   strip:   前後の空白を除く
+#   upper:   大文字にそろえる (型番は大文字表記が普通なので casefold ではなく upper)
+#   pattern: この正規表現に一致する部分を repl に置き換える (例: 末尾の梱包コード "/TR$")
+KeyNormalize = namedtuple('KeyNormalize', 'nfkc strip upper pattern repl',
+                          defaults=(True, True, True, None, ''))
+
+
+def normalize_keys(keys, normalize):
+    """型番の Series を正規化する。空になったものは欠損値にする"""
+    keys = keys.astype(str)
+    if normalize.nfkc:
+        keys = keys.str.normalize('NFKC')
+    if normalize.strip:
+        keys = keys.str.strip()
+    if normalize.upper:
+        keys = keys.str.upper()
+    if normalize.pattern:
+        keys = keys.str.replace(normalize.pattern, normalize.repl, regex=True).str.strip()
+    return keys.mask(keys == '')
+
+
+def _to_numbers(values):
+    """集計列を数値にする。(float64 の配列, 数値にできなかった空でない値の数) を返す
+
+    "1,000" のような桁区切りは取り除いてから変換する (pyarrow や Parquet の文字列列用)。
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_numeric(values).to_numpy(dtype='float64', na_value=0.0), 0
+    text = values.astype('string').str.replace(',', '', regex=False).str.strip()
+    numbers = pd.to_numeric(text, errors='coerce')
+    invalid = int((numbers.isna() & text.notna() & (text != '')).sum())
+    return numbers.to_numpy(dtype='float64', na_value=0.0), invalid
+
+
+def _sum_by_key(df, key_col, val_col, normalize=None):
+    """型番ごとの合計 (Series) と、集計列を数値にできなかった値の数を返す"""
+    values, invalid = _to_numbers(df[val_col])
+    # 型番を整数コードにしてから合計する (文字列のまま groupby するより速く、メモリも少ない)
+    codes, uniques = pd.factorize(df[key_col])
+    if len(uniques) == 0:
+        # 型番が全部空のチャンク (new_codes[-1] で落ちないように先に返す)
+        return pd.Series(dtype='float64', index=pd.Index([], dtype=object, name=key_col)), invalid
+    if normalize is not None:
+        # 正規化は行ごとではなく型番の種類ごとに1回だけ
+        new_codes, uniques = pd.factorize(normalize_keys(pd.Series(uniques), normalize))
+        codes = np.where(codes >= 0, new_codes[codes], -1)
+    valid = codes >= 0  # 型番が空の行は数えない
+    sums = np.bincount(codes[valid], weights=values[valid], minlength=len(uniques))
+    return pd.Series(sums, index=pd.Index(uniques, name=key_col)), invalid
+
+
+def _sum_schematic(name, columns, parts, key_col, val_col, normalize=None):
+    if key_col not in columns or val_col not in columns:
+        raise ValueError(f"ファイル「{name}」に\n指定された列が見つかりません。")
+    df = pd.DataFrame(parts, columns=[key_col, val_col])
+    # フィールドが空の部品も数える (MPN 未記入の部品が消えないように)
+    df[key_col] = df[key_col].fillna('')
+    return (*_sum_by_key(df, key_col, val_col, normalize), len(df))
+
+
+def aggregate_file(path, key_col, val_col, chunksize=CHUNK_ROWS, encoding=None, engine='c', normalize=None,
+                   cancel=None):
+    """1ファイル分を型番ごとに合計した Series (index=型番)、集計列を数値にできなかった値の数、読んだ行数を返す
+
+    数値にできなかった値 (空欄は除く) は 0 として数える。
+
+    encoding を省略した場合は detect_encoding() で判定する。
+    engine='pyarrow' ならCSVを pyarrow で基準列/集計列だけ一括で読む (チャンク分割はしない)。
+    Parquet/Feather は拡張子で判別し、2列だけを直接読む。
+    .kicad_sch は階層をたどって部品1個を1行 (Qty=1) にした表として扱う。
+    normalize (KeyNormalize) を渡すと型番を正規化してから合計する。
+    cancel (threading.Event など) がセットされるとチャンクの間で MergeCancelled を送出する
+    (プロセスプールには渡せないので、このプロセスで読む場合用)。
+    """
+    name = os.path.basename(path)
+    fmt = file_format(path)
+    if fmt == 'kicad_sch':
+        return _sum_schematic(name, *read_schematic(path), key_col, val_col, normalize)
+    if fmt != 'csv':
+        columns = read_header(path)
+        if key_col not in columns or val_col not in columns:
+            raise ValueError(f"ファイル「{name}」に\n指定された列が見つかりません。")
+        if fmt == 'parquet':
+            df = pd.read_parquet(path, columns=[key_col, val_col])
+        else:
+            df = pd.read_feather(path, columns=[key_col, val_col])
+        # 型番は常に文字列として扱う (CSV と同じ型番が数値と文字列に分かれないように)
+        df[key_col] = df[key_col].astype('string')
+        total, invalid = _sum_by_key(df, key_col, val_col, normalize)
+        total.index.name = key_col
+        return total, invalid, len(df)
+
+    if engine == 'pyarrow':
+        _require_pyarrow()
+    if encoding is None:
+        encoding = detect_encoding(path)
+    for enc in _encodings_to_try(encoding):
+        try:
+            columns = read_header(path, enc)
+            if key_col not in columns or val_col not in columns:
+                raise ValueError(f"ファイル「{name}」に\n指定された列が見つかりません。")
+
+            if engine == 'pyarrow':
+                import pyarrow as pa
+                try:
+                    # 型番は文字列として読む。binary のまま読ませると不正なバイト列でもエラーにならず、
+                    # サンプルより後ろの文字コード違いに気づけない
+                    df = pd.read_csv(path, encoding=enc, usecols=[key_col, val_col], engine='pyarrow',
+                                     dtype={key_col: 'string[pyarrow]'})
+                except pa.ArrowInvalid as e:
+                    if 'utf8' not in str(e).lower().replace('-', ''):
+                        raise ValueError(f"ファイル読み込みエラー: {name}\n{e}")
+                    raise UnicodeDecodeError(enc, b'', 0, 1, str(e))
+                total, invalid = _sum_by_key(df, key_col, val_col, normalize)
+                total.index.name = key_col
+                return total, invalid, len(df)
+
+            total = pd.Series(dtype='float64')
+            invalid = 0
+            rows = 0
+            # 型番は文字列で読む。型推論はチャンクごとなので、数字だけのチャンクがあると
+            # 同じ型番が 123 と "123" に分かれる (先頭の 0 も消える)
+            # 数量の "1,000" は桁区切りとして読む (数値にできないと 0 として数えられてしまう)
+            for chunk in pd.read_csv(path, encoding=enc, usecols=[key_col, val_col], chunksize=chunksize,
+                                     dtype={key_col: str}, thousands=','):
+                if cancel is not None and cancel.is_set():
+                    raise MergeCancelled()
+                part, bad = _sum_by_key(chunk, key_col, val_col, normalize)
+                total = total.add(part, fill_value=0)
+                invalid += bad
+                rows += len(chunk)
+            total.index.name = key_col
+            return total, invalid, rows
+        except UnicodeDecodeError:
+            # 途中で失敗した場合はこのファイルの集計を捨てて次の文字コードで読み直す
+            continue
+    raise ValueError(f"ファイル読み込みエラー: {name}")
+
+
+def merge_files(paths, key_col, val_col, chunksize=CHUNK_ROWS, progress=None, encodings=None,
+                workers=1, cancel=None, cache=None, engine='c', validate=True, normalize=None):
+    """複数ファイルを読み込み、基準列ごとに集計列を合計した DataFrame を返す
+
+    progress(done, total, path, rows) を渡すとファイルが終わるたびに呼ばれる (rows は累計行数)。
+    encodings に {path: 文字コード} を渡すと判定済みの文字コードを再利用する。
+    workers が 1 以外ならプロセスプールで並列に読み、終わったファイルから順に合計する
+    (None ならCPUコア数)。.kicad_sch のシートの解析も同じプールで行う。
+    cancel (threading.Event など) がセットされると MergeCancelled を送出する。
+    cache (ParsedFileCache) を渡すと、変わっていないファイルは前回の集計結果を使う。
+    .kicad_sch はヘッダーの確認で解析した結果をそのまま集計に使う (階層の解析は1回だけ)。
+    engine は CSV の読み込みエンジン ('c' または 'pyarrow')。normalize は aggregate_file() と同じ。
+    validate が真なら、集計を始める前に全ファイルのヘッダーを並列に確認し、
+    基準列/集計列が無いファイルがあれば何も読まずに ValueError を送出する。
+    集計列を数値にできなかった値があったファイルは、戻り値の attrs['invalid_values'] に
+    {path: 個数} で入る。
+    """
+    encodings = dict(encodings or {})
+    # .kicad_sch の解析結果の受け渡し用 (cache が無くてもこのマージの中では使い回す)
+    sch_cache = cache if cache is not None else ParsedFileCache()
+    # プロセスプールはこのマージで1つだけ作り、.kicad_sch のシートの解析とファイルの集計で共有する
+    # (プールの起動は重い。ワーカーは最初に仕事を投げた時に起動する)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        if validate:
+            headers = read_headers(paths, encodings, sch_cache, executor=pool)
+            bad = incompatible_files(headers, key_col, val_col)
+            if bad:
+                lines = [f"{os.path.basename(p)}: {reason}" for p, reason in bad[:10]]
+                if len(bad) > 10:
+                    lines.append(f"... ほか {len(bad) - 10} ファイル")
+                raise ValueError(f"{len(bad)} ファイルに指定された列が見つかりません。\n" + "\n".join(lines))
+            # 判定した文字コードは本体の読み込みでも使う
+            for path, (enc, _cols, _error) in headers.items():
+                encodings.setdefault(path, enc)
+        total = pd.Series(dtype='float64')
+        rows = 0
+        done_count = 0
+        invalid_values = {}
+        what = ('sum', key_col, val_col, normalize)
+        cache_keys = {}
+
+        def check_cancel():
+            if cancel is not None and cancel.is_set():
+                raise MergeCancelled()
+
+        def add(path, part, invalid, n):
+            nonlocal total, rows, done_count
+            total = total.add(part, fill_value=0)
+            if invalid:
+                invalid_values[path] = invalid
+            rows += n
+            done_count += 1
+            if progress:
+                progress(done_count, len(paths), path, rows)
+
+        # キャッシュにあるファイルはディスクを読まない。
+        # .kicad_sch はシートの解析をプールで並列に行い、展開と集計はこのプロセスで行う
+        todo = []
+        for path in paths:
+            if file_format(path) == 'kicad_sch':
+                check_cancel()
+                add(path, *_sum_schematic(os.path.basename(path), *read_schematic(path, sch_cache, pool),
+                                          key_col, val_col, normalize))
+                continue
+            if cache is not None:
+                try:
+                    cache_keys[path] = cache.file_key(path, encodings.get(path))
+                except OSError:
+                    todo.append(path)  # 読み込み時にエラーとして報告される
+                    continue
+                hit = cache.get(cache_keys[path], what)
+                if hit is not None:
+                    add(path, *hit)
+                    continue
+            todo.append(path)
+
+        def add_parsed(path, part, invalid, n):
+            if path in cache_keys:
+                cache.put(cache_keys[path], what, (part, invalid, n))
+            add(path, part, invalid, n)
+
+        def result():
+            df = finalize(total, key_col, val_col)
+            df.attrs['invalid_values'] = invalid_values
+            return df
+
+        if pool is None or len(todo) <= 1:
+            for path in todo:
+                check_cancel()
+                # 大きなファイル1つだけの場合もあるので、読み込み中もチャンクごとに中止を確認する
+                add_parsed(path, *aggregate_file(path, key_col, val_col, chunksize, encodings.get(path), engine,
+                                                 normalize, cancel))
+            return result()
+
+        futures = {
+            pool.submit(aggregate_file, path, key_col, val_col, chunksize, encodings.get(path), engine, normalize): path
+            for path in todo
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            check_cancel()
+            for future in done:
+                add_parsed(futures[future], *future.result())
+        return result()
+    finally:
+        # エラー/キャンセル時は未着手のファイルを捨てて戻る
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def finalize(total, key_col, val_col):
+    """集計結果の Series を保存用の DataFrame にする (型番順、整数なら整数に戻す)"""
+    total = total.sort_index()
+    if len(total) and (total % 1 == 0).all():
+        total = total.astype('int64')
+    total.index.name = key_col
+    return total.rename(val_col).reset_index()
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class AggregateStore:
+    """累計を保存する SQLite ファイル (毎週の発注分を足し込んでいく用)
+
+    取り込んだファイルは内容のハッシュで記録するので、同じファイルを何度渡しても二重に足されない。
+    パス/サイズ/mtime が前回と同じファイルはハッシュ計算も省く。
+    取り込み済みのパスの内容が変わっていた場合は何も書き込まずに ValueError を送出する
+    (ファイルごとの内訳は持たないので、前回の内容の分を累計から引けず二重に数えてしまう)。
+    型番の正規化の設定も保存し、違う設定で足し込もうとした場合はエラーにする。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS totals (key TEXT PRIMARY KEY, value REAL NOT NULL);
+    CREATE TABLE IF NOT EXISTS sources (
+        sha256 TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        added_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS sources_path ON sources(path);
+    """
+
+    def __init__(self, path, key_col, val_col, normalize=None):
+        self.path = path
+        self.key_col = key_col
+        self.val_col = val_col
+        self.normalize = normalize
+        self.invalid_values = {}
+        self.con = sqlite3.connect(path)
+        self.con.executescript(self.SCHEMA)
+        meta = dict(self.con.execute("SELECT name, value FROM meta"))
+        normalize_json = json.dumps(list(normalize) if normalize else None)
+        if not meta:
+            self.con.executemany("INSERT INTO meta VALUES (?, ?)",
+                                 [('key_col', key_col), ('val_col', val_col), ('normalize', normalize_json)])
+            self.con.commit()
+        elif (meta.get('key_col'), meta.get('val_col')) != (key_col, val_col):
+            self.con.close()
+            raise ValueError(f"累計ファイルの列 ({meta.get('key_col')} / {meta.get('val_col')}) と"
+                             f"\n選択中の列 ({key_col} / {val_col}) が一致しません。")
+        elif meta.get('normalize', 'null') != normalize_json:
+            self.con.close()
+            raise ValueError("累計ファイルと型番の正規化の設定が一致しません。")
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def new_files(self, paths):
+        """まだ取り込んでいないファイルだけを (path, sha256, stat) のリストで返す
+
+        取り込み済みのパスで内容が変わったファイルがあれば ValueError を送出する。
+        """
+        result = []
+        seen = set()
+        changed = []
+        for path in paths:
+            abspath = os.path.abspath(path)
+            try:
+                st = os.stat(path)
+                known = self.con.execute(
+                    "SELECT 1 FROM sources WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    (abspath, st.st_size, st.st_mtime_ns)).fetchone()
+                if known:
+                    continue
+                digest = file_sha256(path)
+            except OSError as e:
+                raise ValueError(f"ファイルを読み込めません: {path}\n{e}")
+            if digest in seen or self.con.execute("SELECT 1 FROM sources WHERE sha256 = ?", (digest,)).fetchone():
+                continue
+            seen.add(digest)
+            if self.con.execute("SELECT 1 FROM sources WHERE path = ?", (abspath,)).fetchone():
+                changed.append(path)
+            result.append((path, digest, st))
+        if changed:
+            lines = [os.path.basename(p) for p in changed[:10]]
+            if len(changed) > 10:
+                lines.append(f"... ほか {len(changed) - 10} ファイル")
+            raise ValueError(f"取り込み済みのファイルの内容が変わっています ({len(changed)} ファイル)。\n"
+                             "前回の内容の分を累計から引けないため、追加しませんでした。\n"
+                             "内容を変えたファイルは別の名前で保存するか、累計ファイルを作り直してください。\n"
+                             + "\n".join(lines))
+        return result
+
+    def add_files(self, paths, **merge_kwargs):
+        """新しいファイルだけを集計して累計に足し込む。(追加したファイル数, スキップした数) を返す
+
+        集計列を数値にできなかった値の数は invalid_values ({path: 個数}) に入る。
+        取り込み済みのパスで内容が変わったファイルがあれば、何も足し込まずに ValueError を送出する。
+
+        merge_kwargs はそのまま merge_files() に渡す (progress, workers, cancel, engine など)。
+        """
+        self.invalid_values = {}
+        todo = self.new_files(paths)
+        if not todo:
+            return 0, len(paths)
+
+        user_progress = merge_kwargs.pop('progress', None)
+        rows_by_path = {}
+        last_rows = 0
+
+        def progress_hook(done, total, path, rows):
+            nonlocal last_rows
+            rows_by_path[path] = rows - last_rows  # rows は累計なので差分がそのファイルの行数
+            last_rows = rows
+            if user_progress:
+                user_progress(done, total, path, rows)
+
+        df = merge_files([t[0] for t in todo], self.key_col, self.val_col, progress=progress_hook,
+                         normalize=self.normalize, **merge_kwargs)
+        self.invalid_values = df.attrs['invalid_values']
+
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self.con:
+            # 型番ごとに upsert (既存の累計に足す)。ソースの記録と同じトランザクションで行う
+            self.con.executemany(
+                "INSERT INTO totals (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                ((str(k), float(v)) for k, v in zip(df[self.key_col], df[self.val_col])))
+            self.con.executemany(
+                "INSERT INTO sources VALUES (?, ?, ?, ?, ?, ?)",
+                [(digest, os.path.abspath(path), st.st_size, st.st_mtime_ns, rows_by_path.get(path, 0), now)
+                 for path, digest, st in todo])
+        return len(todo), len(paths) - len(todo)
+
+    def to_frame(self):
+        """現在の累計を merge_files() と同じ形の DataFrame で返す"""
+        total = pd.Series(dict(self.con.execute("SELECT key, value FROM totals")), dtype='float64')
+        return finalize(total, self.key_col, self.val_col)
+
+
+def write_result(df, path, parquet=False):
+    """拡張子が .parquet なら Parquet、それ以外は CSV (UTF-8 BOM付き) で保存する
+
+    parquet=True なら CSV と同じ場所に同名の .parquet も書く。保存したパスのリストを返す。
+    """
+    if file_format(path) == 'parquet':
+        _require_pyarrow()
+        df.to_parquet(path, index=False)
+        return [path]
+    df.to_csv(path, index=False, encoding='utf-8-sig')
+    if not parquet:
+        return [path]
+    _require_pyarrow()
+    parquet_path = os.path.splitext(path)[0] + '.parquet'
+    df.to_parquet(parquet_path, index=False)
+    return [path, parquet_path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSV/Parquet/Featherを基準列ごとに集計してマージする (GUIなし版)')
+    parser.add_argument('files', nargs='+', help='入力ファイル (CSV / Parquet / Feather / KiCadのルート回路図 .kicad_sch)。フォルダやワイルドカードも可')
+    parser.add_argument('-k', '--key', required=True, help='基準列 (型番等)')
+    parser.add_argument('-v', '--value', required=True, help='集計列 (数量等)')
+    parser.add_argument('-o', '--output', default='merged_result.csv', help='出力ファイル (既定: merged_result.csv、.parquet なら Parquet)')
+    parser.add_argument('--parquet', action='store_true', help='CSVと同じ場所に .parquet も出力する')
+    parser.add_argument('--store', metavar='SQLITE', help='累計ファイル。まだ取り込んでいない入力だけを足し込み、累計を出力する')
+    parser.add_argument('--normalize', action='store_true', help='型番を正規化して集計する (全角/半角、前後の空白、大文字小文字をそろえる)')
+    parser.add_argument('--key-regex', metavar='PATTERN', help='正規化時に型番から取り除く正規表現 (例: "/TR$")。--normalize を含む')
+    parser.add_argument('--key-repl', default='', metavar='STR', help='--key-regex に一致した部分の置き換え文字列 (既定: 削除)')
+    parser.add_argument('--engine', choices=INPUT_ENGINES, default='c', help='CSVの読み込みエンジン (pyarrow は高速だがチャンク分割しない)')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS, help='1回に読み込む行数')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='並列に読むプロセス数 (既定: CPUコア数)')
+    args = parser.parse_args()
+
+    normalize = None
+    if args.normalize or args.key_regex:
+        if args.key_regex:
+            try:
+                re.compile(args.key_regex)
+            except re.error as e:
+                parser.error(f'--key-regex が正しくありません: {e}')
+        normalize = KeyNormalize(pattern=args.key_regex, repl=args.key_repl)
+
+    files = expand_inputs(args.files)
+    if not files:
+        parser.error('入力ファイルが見つかりません')
+    start = time.perf_counter()
+
+    def progress(done, total, path, rows):
+        rate = rows / max(time.perf_counter() - start, 1e-9)
+        print(f"[{done}/{total}] {os.path.basename(path)} ({rows:,} 行, {rate:,.0f} 行/秒)", file=sys.stderr)
+
+    try:
+        if args.store:
+            with AggregateStore(args.store, args.key, args.value, normalize) as store:
+                added, skipped = store.add_files(files, chunksize=args.chunksize, workers=args.jobs,
+                                                 engine=args.engine, progress=progress)
+                df_merged = store.to_frame()
+                invalid_values = store.invalid_values
+            print(f"累計に追加: {added} ファイル (取り込み済み {skipped} ファイル)", file=sys.stderr)
+        else:
+            df_merged = merge_files(files, args.key, args.value, args.chunksize, progress,
+                                    workers=args.jobs, engine=args.engine, normalize=normalize)
+            invalid_values = df_merged.attrs['invalid_values']
+        for path, count in invalid_values.items():
+            print(f"警告: {os.path.basename(path)}: 集計列の {count} 個の値を数値にできず 0 として数えました",
+                  file=sys.stderr)
+        saved = write_result(df_merged, args.output, parquet=args.parquet)
+    except ValueError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"マージ完了: 合計 {len(df_merged)} 行 -> {', '.join(saved)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,224 @@
 from pathlib import Path
+import argparse
+import fnmatch
+import glob
 import io
+import json
+import os
 import re
-from typing import List, Dict, Any, Tuple, Optional, Set
+import select
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any, Tuple, Optional, Set, Sequence
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from dataclasses import dataclass, field
 
-def parse_sym_lib_table(text: str) -> Tuple[Optional[Any], List[Dict[str, str]]]:
-		
-	version: Optional[Any] = 7
-	version_match = re.search(r'\(\s*version\s+([^\)]+)\)', text)
-	
-	if version_match:
-		version_str = version_match.group(1).strip()
-		try:
-			version = int(version_str)
-		except ValueError:
-			version = 7
-					
-	lib_content_matches = re.finditer(
-		r'\(\s*lib\s+'                  # (lib で始まる
-        r'('                             # グループ1開始 (libの中身)
-          r'(?:\s*'                       # 
-            r'\(\s*(\w+)\s+'              # (key (グループ2: キー)
-            r'"((?:\\"|[^"])*)"'        # "value" (グループ3: 値)
-            r'\s*\)'                      # )
-          r'\s*)+'                       # 上記 (key "value") の1回以上の繰り返し
-        r')'                             # グループ1終了
-        r'\s*\)',                         # 閉じる )
-		text
-	)
-	libs: List[Dict[str, str]] = []
+import kicad_sexpr
+
+def parse_sym_lib_table(text: str) -> Tuple[Optional[Any], List[Dict[str, Any]]]:
 	
-	# 3. 各libブロックの中身を辞書にパース
-	for match in lib_content_matches:
-		# libブロックの中身の文字列 ( (name ...)(type ...)... )
-		content_str = match.group(1)
-		lib_info: Dict[str, str] = {}
-		
-		# (key "value") のペアをすべて見つける
-		value_matches = re.findall(
-			r'\(\s*(\w+)\s+"((?:\\"|[^"])*)"\s*\)', 
-			content_str
-		)
-		
-		for key, value in value_matches:
-			if key in ["name", "type", "uri", "options", "descr"]:
-				lib_info[key] = value.replace(r'\"', '"')
-		
-		if 'name' in lib_info:
-			libs.append(lib_info)
-					
+	version: Optional[Any] = 7
+	libs: List[Dict[str, Any]] = []
+
+	root = kicad_sexpr.loads(text)
+	for child in root[1:]:
+		if not isinstance(child, list) or not child:
+			continue
+
+		if child[0] == 'version' and len(child) > 1:
+			try:
+				version = int(child[1])
+			except (TypeError, ValueError):
+				version = 7
+
+		elif child[0] == 'lib':
+			# (lib (key "value") ...) を辞書にする
+			# 未知のキーや (disabled) のようなフラグも順番ごと保持して書き戻す
+			lib_info: Dict[str, Any] = {}
+			for item in child[1:]:
+				if not isinstance(item, list) or not item or not isinstance(item[0], str):
+					continue
+				key, values = item[0], item[1:]
+				if len(values) == 1 and isinstance(values[0], str):
+					lib_info[key] = values[0]
+				else:
+					lib_info[key] = values
+
+			if isinstance(lib_info.get('name'), str):
+				libs.append(lib_info)
+
 	return version, libs
 
 
+def format_lib_table(table_name: str, version: Optional[Any], libs: List[Dict[str, Any]]) -> str:
+	out = io.StringIO()
+	out.write('('+table_name.replace('-','_')+'\n')#header
+	out.write('\t(version ' + str(version) + ')\n')#version
+	for l in libs:
+		out.write('\t(lib ')#head
+		for key, value in l.items():
+			if isinstance(value, str):
+				out.write('('+key+' '+kicad_sexpr.quote(value)+')')
+			else:
+				out.write(kicad_sexpr.dumps([key] + list(value)))
+		out.write(')\n')#end
+	out.write(')\n')#end
+	return out.getvalue()
+
+
 
-def file_open(path) -> Tuple[io.TextIOWrapper,str] | None:
+def file_read(path) -> Optional[str]:
 	file = Path(path)
 
 	try:
-		f = file.open(mode='r+', encoding='utf-8')
-		data = f.read()
-		f.seek(0)
-		f.truncate()
-		return (f,data)
+		return file.read_text(encoding='utf-8')
 	except FileNotFoundError:
-		try:
-			f = file.open(mode='w', encoding='utf-8')
-			return (f,"")
-		except IOError as e:
-			print(f"ファイルの作成に失敗しました: {e}")	
-			return None
-	except IOError as e:
+		return ""
+	except (IOError, UnicodeDecodeError) as e:
 		print(f"ファイルの読み込みに失敗しました: {e}")
 		return None
 
 
+def file_write_if_changed(path, content: str, old: Optional[str] = None) -> bool:
+	"""内容が変わった時だけ一時ファイル + rename で置き換える。書き込んだら True"""
+	file = Path(path)
+	if old is None:
+		old = file_read(file)
+	if old == content:
+		return False
+
+	fd, tmp = tempfile.mkstemp(prefix='.'+file.name+'.', suffix='.tmp', dir=str(file.parent))
+	try:
+		with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+			f.write(content)
+			f.flush()
+			os.fsync(f.fileno())
+		if file.exists():
+			shutil.copymode(file, tmp)
+		os.replace(tmp, file)
+	except BaseException:
+		try:
+			os.unlink(tmp)
+		except OSError:
+			pass
+		raise
+	return True
+
+
+
+def _stat_key(st: os.stat_result) -> List[int]:
+	return [st.st_mtime_ns, st.st_ino, st.st_dev, st.st_size]
+
+
+def manifest_load(path) -> Dict[str, Any]:
+	"""前回のスキャン結果 (フォルダのmtime/inodeと見つかったライブラリ) を読み込む"""
+	try:
+		data = json.loads(Path(path).read_text(encoding='utf-8'))
+	except (OSError, ValueError):
+		data = None
+	if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+		data = {'version': MANIFEST_VERSION}
+	data.setdefault('dirs', {})
+	data.setdefault('tables', {})
+	return data
+
+
+def manifest_save(path, manifest: Dict[str, Any]) -> None:
+	try:
+		file_write_if_changed(path, json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True) + '\n')
+	except OSError as e:
+		print(f"キャッシュの保存に失敗しました: {e}")
+
+
+def _scan_one(path: str, suffixes: Tuple[str, ...], cached: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], bool, bool]:
+	"""1フォルダ分の scandir。戻り値は (記録, キャッシュを使ったか, 直近に変更されたか)"""
+	st = os.stat(path)
+	stat_key = _stat_key(st)
+	if cached and cached.get('stat') == stat_key and not cached.get('recent'):
+		return cached, True, False
+
+	entries: List[str] = []
+	dirs: List[str] = []
+	with os.scandir(path) as it:
+		for item in it:
+			if item.name.endswith(suffixes):
+				entries.append(item.name)
+			elif item.is_dir(follow_symlinks=False):
+				dirs.append(item.name)
+
+	# mtimeの分解能内にさらに変更されると検出できないので、直近に変わったフォルダは記録しない
+	recent = time.time_ns() - st.st_mtime_ns <= MANIFEST_MTIME_GUARD_NS
+	return {'stat': stat_key, 'entries': entries, 'dirs': dirs}, False, recent
+
+
+def _ignored(name: str, rel: str, ignore: Sequence[str]) -> bool:
+	return any(fnmatch.fnmatch(name, pat) or fnmatch.fnmatch(rel, pat) for pat in ignore)
+
+
+def scan_library_dir(target_dir: Path, suffixes: Tuple[str, ...], manifest: Dict[str, Any],
+                     max_depth: Optional[int] = 1, ignore: Sequence[str] = (),
+                     jobs: Optional[int] = None, project_root: Optional[Path] = None) -> Tuple[List[str], bool]:
+	"""target_dir 以下のライブラリ一覧を返す。前回から変わっていないフォルダは scandir しない
+
+	max_depth=1 なら直下のみ、None なら無制限に潜る (.pretty などライブラリ自体の中と隠しフォルダには入らない)。
+	サブフォルダはスレッドプールで並列にスキャンする。
+	target_dir は project_root からの相対パスで、マニフェストのキーにもこの相対パスを使う。
+	戻り値は (target_dir からの相対パス, すべてキャッシュだったか)
+	"""
+	root = target_dir.as_posix()
+	base = str(project_root) if project_root is not None else ''
+	dirs_cache: Dict[str, Any] = manifest['dirs']
+	found: List[str] = []
+	visited: Set[str] = set()
+	all_cached = True
+
+	with ThreadPoolExecutor(max_workers=jobs) as pool:
+		pending = {pool.submit(_scan_one, os.path.join(base, root), suffixes, dirs_cache.get(root)): ('', 1)}
+		while pending:
+			done, _ = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				rel, depth = pending.pop(future)
+				key = root + '/' + rel if rel else root
+				try:
+					record, cached, recent = future.result()
+				except OSError as err:
+					if not rel:
+						raise
+					print(f"ファイルの取得に失敗しました: {err}")
+					all_cached = False
+					continue
 
+				visited.add(key)
+				all_cached = all_cached and cached
+				if recent:
+					# 直近に変わったフォルダは次回も読み直す (サブフォルダ一覧としては残す)
+					dirs_cache[key] = dict(record, recent=True)
+				elif not cached:
+					dirs_cache[key] = record
 
+				prefix = rel + '/' if rel else ''
+				for name in record['entries']:
+					if not _ignored(name, prefix + name, ignore):
+						found.append(prefix + name)
+
+				if max_depth is not None and depth >= max_depth:
+					continue
+				for name in record['dirs']:
+					child = prefix + name
+					if name.startswith('.') or _ignored(name, child, ignore):
+						continue
+					child_key = root + '/' + child
+					pending[pool.submit(_scan_one, os.path.join(base, child_key), suffixes, dirs_cache.get(child_key))] = (child, depth + 1)
+
+	# 消えたサブフォルダの記録を掃除
+	for key in [k for k in dirs_cache if k.startswith(root + '/') and k not in visited]:
+		del dirs_cache[key]
+
+	found.sort()
+	return found, all_cached
 
 
 
@@ -87,54 +231,646 @@ FOOTPL_DIR = "./library/footprints"
 SYMBOL_DIR = "./library/symbols"
 DESIGN_DIR = "./library/designs"
 
-##### ライブラリフォルダの生成
-model_dir        = Path(MODELS_DIR)
-symbol_dir       = Path(SYMBOL_DIR)
-footprint_dir    = Path(FOOTPL_DIR)
-design_block_dir = Path(DESIGN_DIR)
+MANIFEST_FILE = ".reload_library_cache.json"
+MANIFEST_VERSION = 2
+MANIFEST_MTIME_GUARD_NS = 2_000_000_000
 
-try:
-	model_dir.mkdir       (parents=True, exist_ok=True)
-	symbol_dir.mkdir      (parents=True, exist_ok=True)
-	footprint_dir.mkdir   (parents=True, exist_ok=True)
-	design_block_dir.mkdir(parents=True, exist_ok=True)
-except OSError as e:
-	print(f"フォルダーの作成に失敗しました: {e}")
+TABLE_DIRS = {FOOTPL_PROP: FOOTPL_DIR, SYMBOL_PROP: SYMBOL_DIR, DESIGN_PROP: DESIGN_DIR}
+LIB_SUFFIXES = (".kicad_sym", ".pretty")
 
 
-file_list = [FOOTPL_PROP,SYMBOL_PROP,DESIGN_PROP]
-file_depend = {FOOTPL_PROP:footprint_dir,SYMBOL_PROP:symbol_dir,DESIGN_PROP:design_block_dir}
+def lib_uri(target_dir, rel: str) -> str:
+	# Windows でも / 区切りにする (バックスラッシュはS式のエスケープと紛らわしい)
+	return '${KIPRJMOD}/'+Path(target_dir).as_posix()+'/'+rel
 
-for e in file_list:
-	(file,s) = file_open(e)
-	with file  as f:
-		(version,libs) = parse_sym_lib_table(s) #パース
 
-		suffixes = (".kicad_sym", ".pretty")
+def new_lib_entry(target_dir, rel: str) -> Dict[str, Any]:
+	lib_info: Dict[str, Any] = {}
+	lib_info["name"] = Path(rel).stem
+	lib_info["type"] = 'KiCad'
+	lib_info["uri"]     = lib_uri(target_dir, rel)
+	lib_info["options"] =''
+	lib_info["descr"]   = ''
+	return lib_info
+
+
+_VAR_RE = re.compile(r'\$\{([^}]+)\}|\$\(([^)]+)\)')
+
+
+def path_variables(project: Path, extra: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+	"""パス変数の一覧: 環境変数 + KIPRJMOD (プロジェクトフォルダ) + extra"""
+	variables = dict(os.environ)
+	variables['KIPRJMOD'] = str(project.resolve())
+	if extra:
+		variables.update(extra)
+	return variables
+
+
+def resolve_path_vars(ref: str, variables: Dict[str, str], project: Path) -> Tuple[Optional[str], Optional[str]]:
+	"""${VAR} / $(VAR) を展開して正規化した絶対パスにする。戻り値は (パス, 未解決の変数名)
+
+	相対パスはプロジェクトフォルダからの相対とみなす。
+	"""
+	missing: List[str] = []
+
+	def sub(m: re.Match) -> str:
+		name = m.group(1) or m.group(2)
+		if name in variables:
+			return variables[name]
+		missing.append(name)
+		return m.group(0)
+
+	expanded = _VAR_RE.sub(sub, ref)
+	if missing:
+		return None, missing[0]
+	if not os.path.isabs(expanded):
+		expanded = os.path.join(project.resolve(), expanded)
+	return os.path.normcase(os.path.normpath(os.path.abspath(expanded))), None
+
+
+def expand_lib_uri(uri: str, project: Path, variables: Optional[Dict[str, str]] = None) -> Optional[str]:
+	"""${KIPRJMOD} や環境変数を展開した絶対パス。展開できない/URLの場合は None"""
+	if '://' in uri:
+		return None
+	if variables is None:
+		variables = path_variables(project)
+	return resolve_path_vars(uri, variables, project)[0]
+
+
+def verify_lib_entries(libs: List[Dict[str, Any]], project: Path,
+                       jobs: Optional[int] = None) -> Tuple[Set[int], Set[int], Set[int], List[str]]:
+	"""既存エントリを一括で確認する
+
+	戻り値は (存在しない添字, 確認できない添字, 名前もuriも同じ重複の添字, 重複の警告)。
+	存在確認は一意なパスごとに1回だけ、スレッドプールでまとめて行う (ネットワークドライブ向け)。
+	"""
+	variables = path_variables(project)
+	paths: List[Optional[str]] = []
+	for lib in libs:
+		uri = lib.get('uri')
+		paths.append(expand_lib_uri(uri, project, variables) if isinstance(uri, str) else None)
+
+	unique = list({p for p in paths if p is not None})
+	with ThreadPoolExecutor(max_workers=jobs) as pool:
+		exists = dict(zip(unique, pool.map(os.path.exists, unique)))
+
+	dead = {i for i, p in enumerate(paths) if p is not None and not exists[p]}
+	unknown = {i for i, p in enumerate(paths) if p is None}
+
+	# 重複は名前/uriをキーにした辞書で1パスで検出する
+	redundant: Set[int] = set()
+	warnings: List[str] = []
+	first_by_name: Dict[str, int] = {}
+	first_by_uri: Dict[str, int] = {}
+	for i, lib in enumerate(libs):
+		name = lib.get('name')
+		uri_key = paths[i] or lib.get('uri')
+		j = first_by_name.setdefault(name, i)
+		if j != i:
+			if uri_key == (paths[j] or libs[j].get('uri')):
+				redundant.add(i)
+			else:
+				warnings.append(f"名前が重複しています: {name} ({libs[j].get('uri')} / {lib.get('uri')})")
+			continue
+		if isinstance(uri_key, str):
+			k = first_by_uri.setdefault(uri_key, i)
+			if k != i:
+				warnings.append(f"同じライブラリが別名で登録されています: {libs[k].get('name')} / {name} ({lib.get('uri')})")
+	return dead, unknown, redundant, warnings
+
+
+@dataclass
+class ReloadOptions:
+	check: bool = False                  # 書き込まずに差分の有無だけ調べる
+	max_depth: Optional[int] = 1         # None なら無制限
+	ignore: List[str] = field(default_factory=list)
+	jobs: Optional[int] = None           # フォルダスキャンのスレッド数
+	no_cache: bool = False
+	verify: bool = False                 # 既存エントリの uri の存在と重複を確認して警告する
+	prune: bool = False                  # 存在しないエントリと完全な重複を削除する
+
+
+@dataclass
+class TableResult:
+	name: str
+	state: str
+	added: List[str] = field(default_factory=list)
+	existing: int = 0
+	warnings: List[str] = field(default_factory=list)
+	removed: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ProjectResult:
+	root: str
+	tables: List[TableResult] = field(default_factory=list)
+	error: Optional[str] = None
+	elapsed: float = 0.0
+
+	@property
+	def changed(self) -> bool:
+		return any(t.state in ("更新", "要更新") for t in self.tables)
+
+	@property
+	def failed(self) -> bool:
+		return self.error is not None or any(t.state == "書き込み失敗" for t in self.tables)
+
+
+def reload_project(root, options: Optional[ReloadOptions] = None) -> ProjectResult:
+	"""1プロジェクト分のライブラリテーブルを再生成する。パスはすべて root からの相対"""
+	if options is None:
+		options = ReloadOptions()
+	start = time.perf_counter()
+	project = Path(root)
+	result = ProjectResult(root=str(project))
+
+	##### ライブラリフォルダの生成
+	model_dir        = Path(MODELS_DIR)
+	symbol_dir       = Path(SYMBOL_DIR)
+	footprint_dir    = Path(FOOTPL_DIR)
+	design_block_dir = Path(DESIGN_DIR)
+
+	if not options.check:
+		try:
+			for d in (model_dir, symbol_dir, footprint_dir, design_block_dir):
+				(project / d).mkdir(parents=True, exist_ok=True)
+		except OSError as e:
+			result.error = f"フォルダーの作成に失敗しました: {e}"
+			return result
+
+
+	file_list = [FOOTPL_PROP,SYMBOL_PROP,DESIGN_PROP]
+	file_depend = {FOOTPL_PROP:footprint_dir,SYMBOL_PROP:symbol_dir,DESIGN_PROP:design_block_dir}
+
+	scan_options = [options.max_depth, sorted(options.ignore)] # 条件が変わったらテーブルのキャッシュは使わない
+
+	manifest_path = project / MANIFEST_FILE
+	manifest = manifest_load(manifest_path)
+	if options.no_cache:
+		manifest['dirs'].clear()
+		manifest['tables'].clear()
+
+	for e in file_list:
+		suffixes = LIB_SUFFIXES
 		target_dir = Path(file_depend[e])
+		table_path = project / e
+		warnings: List[str] = []
+
+		#ライブラリファイルの一覧 (フォルダが前回から変わっていなければキャッシュを使う)
+		try:
+			entries, dir_cached = scan_library_dir(target_dir, suffixes, manifest,
+			                                       max_depth=options.max_depth, ignore=options.ignore,
+			                                       jobs=options.jobs, project_root=project)
+		except FileNotFoundError:
+			entries, dir_cached = [], False
+		except OSError as err:
+			warnings.append(f"ファイルの取得に失敗しました: {err}")
+			entries, dir_cached = [], False
+
+		#フォルダもテーブルも前回から変わっていなければ読み込み自体を省略
+		table_cache = manifest['tables'].get(e)
+		try:
+			table_stat = _stat_key(os.stat(table_path))
+		except OSError:
+			table_stat = None
+		if (dir_cached and table_cache and table_cache.get('stat') == table_stat and table_cache.get('scan') == scan_options
+		        and not (options.verify or options.prune)):
+			result.tables.append(TableResult(e, "変更なし", existing=table_cache.get('count', 0)))
+			continue
+
+		s = file_read(table_path)
+		if s is None:
+			result.tables.append(TableResult(e, "読み込み失敗", warnings=warnings))
+			continue
+		(version,libs) = parse_sym_lib_table(s) #パース
+		unchanged = len(libs)
+
+		#既存エントリの確認 (存在しないライブラリ/重複)
+		removed: List[str] = []
+		if options.verify or options.prune:
+			dead, unknown, redundant, dup_warnings = verify_lib_entries(libs, project, options.jobs)
+			warnings.extend(dup_warnings)
+			for i in sorted(unknown):
+				warnings.append(f"存在を確認できません: {libs[i].get('name')} ({libs[i].get('uri')})")
+			if options.prune:
+				drop = dead | redundant
+				removed = [libs[i].get('name') for i in sorted(drop)]
+				libs = [lib for i, lib in enumerate(libs) if i not in drop]
+			else:
+				for i in sorted(dead):
+					warnings.append(f"存在しないライブラリ: {libs[i].get('name')} ({libs[i].get('uri')})")
+				for i in sorted(redundant):
+					warnings.append(f"完全に重複したエントリ: {libs[i].get('name')}")
 
 		#ライブラリファイルの読み込み
 		existing_names: Set[str] = set(lib.get("name") for lib in libs if lib.get("name"))
+		added: List[str] = []
+		added_names: Set[str] = set()
+		for rel in entries:
+			stem = Path(rel).stem
+			if stem in added_names:
+				warnings.append(f"名前が重複しているためスキップ: {rel}")
+			elif stem not in existing_names:
+				libs.append(new_lib_entry(file_depend[e], rel))
+				existing_names.add(stem)
+				added.append(stem)
+				added_names.add(stem)
+
+		#テーブルの生成 (メモリ上)
+		content = format_lib_table(e, version, libs)
+		if content == s:
+			state = "変更なし"
+		elif options.check:
+			state = "要更新"
+		else:
+			#変更がある時だけ書き込み
+			try:
+				file_write_if_changed(table_path, content, old=s)
+				state = "更新"
+			except OSError as err:
+				warnings.append(f"ファイルの書き込みに失敗しました: {err}")
+				state = "書き込み失敗"
+
+		result.tables.append(TableResult(e, state, added, unchanged, warnings, removed))
+
+		#書き込み後のテーブルの状態を記録 (要更新/失敗の場合は次回も読み直す)
+		manifest['tables'].pop(e, None)
+		if state in ("変更なし", "更新"):
+			try:
+				manifest['tables'][e] = {'stat': _stat_key(os.stat(table_path)), 'count': len(libs), 'scan': scan_options}
+			except OSError:
+				pass
+
+	if not options.check:
+		manifest_save(manifest_path, manifest)
+
+	result.elapsed = time.perf_counter() - start
+	return result
+
+
+def _reload_project_safe(root: str, options: ReloadOptions) -> ProjectResult:
+	# プロセスプールから呼ぶ用。例外は結果に詰めて返す
+	try:
+		return reload_project(root, options)
+	except Exception as e:
+		return ProjectResult(root=root, error=f"{type(e).__name__}: {e}")
+
+
+def expand_project_roots(patterns: Sequence[str]) -> List[str]:
+	"""プロジェクトフォルダ / .kicad_pro / glob パターンをプロジェクトフォルダの一覧にする"""
+	roots: List[str] = []
+	seen: Set[str] = set()
+	for pattern in patterns:
+		if glob.has_magic(pattern):
+			matches = sorted(glob.glob(pattern, recursive=True))
+			if not matches:
+				print(f"一致するプロジェクトがありません: {pattern}")
+		else:
+			matches = [pattern]
+		for m in matches:
+			path = Path(m)
+			if path.suffix == '.kicad_pro' or path.is_file():
+				path = path.parent
+			key = os.path.normpath(os.path.abspath(path))
+			if key not in seen:
+				seen.add(key)
+				roots.append(str(path))
+	return roots
+
+
+def print_result(result: ProjectResult, show_root: bool) -> None:
+	indent = '\t' if show_root else ''
+	if show_root:
+		print(f"[{result.root}] ({result.elapsed*1e3:.0f} ms)")
+	if result.error:
+		print(f"{indent}エラー: {result.error}")
+	for t in result.tables:
+		print(f"{indent}{t.name}: {t.state} (追加 {len(t.added)} / 既存 {t.existing}"
+		      + (f" / 削除 {len(t.removed)})" if t.removed else ")"))
+		for name in t.added:
+			print(f"{indent}\t+ {name}")
+		for name in t.removed:
+			print(f"{indent}\t- {name}")
+		for w in t.warnings:
+			print(f"{indent}\t! {w}")
+
+
+##### watchモード
+
+class _InotifyWatcher:
+	"""Linux の inotify (ctypes経由) でフォルダの追加/削除/リネームを待つ"""
+
+	IN_MOVED_FROM  = 0x00000040
+	IN_MOVED_TO    = 0x00000080
+	IN_CREATE      = 0x00000100
+	IN_DELETE      = 0x00000200
+	IN_DELETE_SELF = 0x00000400
+	IN_MOVE_SELF   = 0x00000800
+	IN_IGNORED     = 0x00008000
+	MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+	def __init__(self):
+		import ctypes
+		import ctypes.util
+		self._ctypes = ctypes
+		self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self.fd < 0:
+			err = ctypes.get_errno()
+			raise OSError(err, os.strerror(err))
+		self.wd_path: Dict[int, str] = {}
+		self.path_wd: Dict[str, int] = {}
+
+	def sync(self, paths: Sequence[str]) -> None:
+		wanted = set(paths)
+		for path in [p for p in self.path_wd if p not in wanted]:
+			self._libc.inotify_rm_watch(self.fd, self.path_wd.pop(path))
+		for path in wanted:
+			if path in self.path_wd:
+				continue
+			wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+			if wd >= 0:
+				self.wd_path[wd] = path
+				self.path_wd[path] = wd
+
+	def wait(self, timeout: Optional[float]) -> Set[str]:
+		ready, _, _ = select.select([self.fd], [], [], timeout)
+		if not ready:
+			return set()
+		changed: Set[str] = set()
+		while True:
+			try:
+				data = os.read(self.fd, 65536)
+			except BlockingIOError:
+				break
+			offset = 0
+			while offset + 16 <= len(data):
+				wd, mask, _cookie, length = struct.unpack_from('iIII', data, offset)
+				offset += 16 + length
+				path = self.wd_path.get(wd)
+				if path is None:
+					continue
+				changed.add(path)
+				if mask & self.IN_IGNORED:
+					del self.wd_path[wd]
+					self.path_wd.pop(path, None)
+		return changed
+
+	def close(self) -> None:
+		os.close(self.fd)
+
+
+class _PollWatcher:
+	"""inotify が使えない環境 (Linux以外やネットワークドライブ) 用。フォルダのmtimeを定期的に比べる"""
+
+	def __init__(self, interval: float = 1.0):
+		self.interval = interval
+		self.stats: Dict[str, Optional[List[int]]] = {}
+
+	@staticmethod
+	def _stat(path: str) -> Optional[List[int]]:
+		try:
+			return _stat_key(os.stat(path))
+		except OSError:
+			return None
+
+	def sync(self, paths: Sequence[str]) -> None:
+		self.stats = {p: self.stats[p] if p in self.stats else self._stat(p) for p in paths}
+
+	def wait(self, timeout: Optional[float]) -> Set[str]:
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while True:
+			remaining = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+			if remaining > 0:
+				time.sleep(remaining)
+			changed = set()
+			for path, old in self.stats.items():
+				new = self._stat(path)
+				if new != old:
+					self.stats[path] = new
+					changed.add(path)
+			if changed or (deadline is not None and time.monotonic() >= deadline):
+				return changed
+
+	def close(self) -> None:
+		pass
+
+
+class _TableState:
+	"""watchモード中にメモリ上に保持するテーブル"""
+
+	def __init__(self, name: str, target_dir: str):
+		self.name = name
+		self.target_dir = target_dir
+		self.version: Optional[Any] = 7
+		self.libs: List[Dict[str, Any]] = []
+		self.text = ""
+		self.stat: Optional[List[int]] = None
+		self.entries: Set[str] = set()
+
+	def load(self, project: Path) -> None:
+		text = file_read(project / self.name)
+		if text is None:
+			return
+		self.text = text
+		self.version, self.libs = parse_sym_lib_table(text)
+		try:
+			self.stat = _stat_key(os.stat(project / self.name))
+		except OSError:
+			self.stat = None
+
+
+def watch_project(root, options: Optional[ReloadOptions] = None, debounce: float = 0.5,
+                  max_delay: float = 5.0, poll: bool = False, poll_interval: float = 1.0) -> None:
+	"""library/ 以下を監視し、追加/削除されたライブラリだけをテーブルに反映し続ける
+
+	イベントがまとめて来ても debounce 秒静かになるまで (最長 max_delay 秒) 待ってから1回だけ書き込む。
+	"""
+	if options is None:
+		options = ReloadOptions()
+	project = Path(root)
+
+	print_result(reload_project(project, options), show_root=False)
+
+	manifest = manifest_load(project / MANIFEST_FILE)
+	scan_options = [options.max_depth, sorted(options.ignore)]
+	states: Dict[str, _TableState] = {}
+	for name, target_dir in TABLE_DIRS.items():
+		state = _TableState(name, target_dir)
+		state.load(project)
 		try:
-			for item in target_dir.iterdir():
-				if item.name.endswith(suffixes) and item.stem not in existing_names:
-					lib_info: Dict[str, str] = {}
-					lib_info["name"] = item.stem
-					lib_info["type"] = 'KiCad'
-					lib_info["uri"]     = '${KIPRJMOD}/'+str(file_depend[e])+'/'+item.name
-					lib_info["options"] =''
-					lib_info["descr"]   = ''
-					libs.append(lib_info)
-		except e:
-			print("ファイルの取得に失敗しました: {e}")
-
-		#テーブルへの書き込み
-		f.write('('+e.replace('-','_')+'\n')#header
-		f.write('\t(version ' + str(version) + ')\n')#virsion
-		for l in libs:
-			f.write('\t(lib ')#head
-			for key in ["name", "type", "uri", "options", "descr"]:
-				f.write('('+key+' \"'+ l[key] +'\")')
-			f.write(')\n')#end
-		f.write(')\n')#end
-		
+			entries, _ = scan_library_dir(Path(target_dir), LIB_SUFFIXES, manifest, max_depth=options.max_depth,
+			                              ignore=options.ignore, jobs=options.jobs, project_root=project)
+		except OSError:
+			entries = []
+		state.entries = set(entries)
+		states[name] = state
+
+	watcher: Any = None
+	if not poll:
+		try:
+			watcher = _InotifyWatcher()
+		except (OSError, AttributeError) as e:
+			print(f"inotify が使えないためポーリングで監視します: {e}")
+	if watcher is None:
+		watcher = _PollWatcher(poll_interval)
+
+	top_dirs = [Path(d).as_posix() for d in (SYMBOL_DIR, FOOTPL_DIR, DESIGN_DIR, MODELS_DIR)]
+
+	def watched_dirs() -> List[str]:
+		# 各ライブラリフォルダと、そのサブフォルダ (--recursive 時にマニフェストに記録されたもの)
+		keys = set(top_dirs)
+		keys.update(k for k in manifest['dirs'] if any(k.startswith(t + '/') for t in top_dirs))
+		return [str(project / k) for k in sorted(keys)]
+
+	print(f"監視中... (Ctrl+C で終了) [{type(watcher).__name__.strip('_')}]")
+	try:
+		while True:
+			watcher.sync(watched_dirs())
+			changed = watcher.wait(None)
+			if not changed:
+				continue
+
+			# まとめて来るイベントを待つ (デバウンス)
+			deadline = time.monotonic() + max_delay
+			while True:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				more = watcher.wait(min(debounce, remaining))
+				if not more:
+					break
+				changed |= more
+
+			rels = {Path(os.path.relpath(c, project)).as_posix() for c in changed}
+			for name, state in states.items():
+				top = Path(state.target_dir).as_posix()
+				if any(r == top or r.startswith(top + '/') for r in rels):
+					_apply_table_changes(project, state, manifest, options, scan_options)
+			if any(r == top_dirs[3] or r.startswith(top_dirs[3] + '/') for r in rels):
+				print(f"{top_dirs[3]}: 変更を検出 (テーブルへの反映は不要)")
+			manifest_save(project / MANIFEST_FILE, manifest)
+	except KeyboardInterrupt:
+		print("監視を終了します")
+	finally:
+		watcher.close()
+
+
+def _apply_table_changes(project: Path, state: _TableState, manifest: Dict[str, Any],
+                         options: ReloadOptions, scan_options: List[Any]) -> None:
+	try:
+		entries, _ = scan_library_dir(Path(state.target_dir), LIB_SUFFIXES, manifest, max_depth=options.max_depth,
+		                              ignore=options.ignore, jobs=options.jobs, project_root=project)
+	except OSError as e:
+		print(f"ファイルの取得に失敗しました: {e}")
+		return
+	new_entries = set(entries)
+	added_rels = [rel for rel in entries if rel not in state.entries]
+	removed_rels = state.entries - new_entries
+	state.entries = new_entries
+	if not added_rels and not removed_rels:
+		return
+
+	# KiCad などがテーブルを書き換えていたら読み直す
+	table_path = project / state.name
+	try:
+		current_stat = _stat_key(os.stat(table_path))
+	except OSError:
+		current_stat = None
+	if current_stat != state.stat:
+		state.load(project)
+
+	# 差分だけを反映
+	removed_uris = {lib_uri(state.target_dir, rel) for rel in removed_rels}
+	before = len(state.libs)
+	state.libs = [lib for lib in state.libs if lib.get('uri') not in removed_uris]
+	removed = before - len(state.libs)
+	names = set(lib.get('name') for lib in state.libs)
+	added: List[str] = []
+	for rel in added_rels:
+		entry = new_lib_entry(state.target_dir, rel)
+		if entry['name'] not in names:
+			state.libs.append(entry)
+			names.add(entry['name'])
+			added.append(entry['name'])
+
+	content = format_lib_table(state.name, state.version, state.libs)
+	try:
+		written = file_write_if_changed(table_path, content, old=state.text)
+	except OSError as e:
+		print(f"ファイルの書き込みに失敗しました: {e}")
+		return
+	state.text = content
+	try:
+		state.stat = _stat_key(os.stat(table_path))
+		manifest['tables'][state.name] = {'stat': state.stat, 'count': len(state.libs), 'scan': scan_options}
+	except OSError:
+		state.stat = None
+
+	print(f"{time.strftime('%H:%M:%S')} {state.name}: {'更新' if written else '変更なし'} (追加 {len(added)} / 削除 {removed})")
+	for name in added:
+		print(f"\t+ {name}")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='KiCad ライブラリテーブル (sym/fp/design-block) の再生成')
+	parser.add_argument('projects', nargs='*', default=['.'], help='プロジェクトフォルダ / .kicad_pro / globパターン (例: "boards/**/*.kicad_pro") 。既定はカレントフォルダ')
+	parser.add_argument('--check', action='store_true', help='書き込まずに差分の有無だけ確認する (更新が必要なら終了コード1)')
+	parser.add_argument('-r', '--recursive', action='store_true', help='サブフォルダ (例: footprints/<vendor>/<family>.pretty) も探す')
+	parser.add_argument('--max-depth', type=int, default=None, help='サブフォルダに潜る深さ (--recursive を含む。既定: -r なら無制限)')
+	parser.add_argument('--ignore', action='append', default=[], metavar='PATTERN', help='除外するファイル/フォルダ名または相対パスのパターン (複数指定可)')
+	parser.add_argument('-j', '--jobs', type=int, default=None, help='フォルダスキャンのスレッド数')
+	parser.add_argument('-p', '--processes', type=int, default=None, help='複数プロジェクトを並列処理するプロセス数')
+	parser.add_argument('--verify', action='store_true', help='既存エントリの uri が存在するか、名前/uri が重複していないかを確認する')
+	parser.add_argument('--prune', action='store_true', help='存在しないライブラリと完全に重複したエントリをテーブルから削除する')
+	parser.add_argument('-w', '--watch', action='store_true', help='library/ 以下を監視して、追加/削除を自動でテーブルに反映し続ける')
+	parser.add_argument('--poll', action='store_true', help='--watch で inotify を使わずにポーリングする (ネットワークドライブ向け)')
+	parser.add_argument('--debounce', type=float, default=0.5, help='--watch で変更が落ち着くまで待つ秒数')
+	parser.add_argument('--no-cache', action='store_true', help=f'{MANIFEST_FILE} を無視してすべて再スキャンする')
+	args = parser.parse_args()
+	if args.max_depth is not None:
+		if args.max_depth < 1:
+			parser.error('--max-depth は 1 以上を指定してください')
+		args.recursive = True  # 深さを指定したら -r が無くてもその深さまで潜る
+
+	options = ReloadOptions(
+		check=args.check,
+		max_depth=args.max_depth if args.recursive else 1,
+		ignore=args.ignore,
+		jobs=args.jobs,
+		no_cache=args.no_cache,
+		verify=args.verify,
+		prune=args.prune,
+	)
+
+	roots = expand_project_roots(args.projects)
+	if args.watch:
+		if len(roots) != 1 or args.check:
+			parser.error('--watch は1プロジェクトのみ、--check とは併用できません')
+		watch_project(roots[0], options, debounce=args.debounce, poll=args.poll)
+		return
+
+	if len(roots) == 1:
+		results = [_reload_project_safe(roots[0], options)]
+		print_result(results[0], show_root=False)
+	else:
+		results = []
+		with ProcessPoolExecutor(max_workers=args.processes) as pool:
+			futures = [pool.submit(_reload_project_safe, root, options) for root in roots]
+			for future in as_completed(futures):
+				result = future.result()
+				results.append(result)
+				print_result(result, show_root=True)
+
+		failed = sum(1 for r in results if r.failed)
+		changed = sum(1 for r in results if r.changed and not r.failed)
+		print(f"\n{len(results)} プロジェクト: 変更 {changed} / 変更なし {len(results) - changed - failed} / エラー {failed}")
+
+	if any(r.failed for r in results):
+		sys.exit(2)
+	if args.check and any(r.changed for r in results):
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,209 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import kicad_sexpr
+from kicad_sexpr import find, find_all
+
+# .kicad_sch から直接 BOM を作る (CSVを書き出さずに merge_bom に渡すため)
+# 各シートはルート直下のノードを読みながら処理し、プールを渡せばシートファイルごとに並列に解析する
+# 同じシートファイルが複数回使われている場合 (マルチインスタンス) は、解析は1回で数量はインスタンス分数える
+
+QTY_COLUMN = 'Qty'
+BASE_FIELDS = ('Reference', 'Value', 'Footprint')
+
+
+@dataclass
+class SchSymbol:
+	lib_id: str
+	uuid: str
+	fields: Dict[str, str]
+	references: Dict[str, str]  # インスタンスのパス -> リファレンス (KiCad 7以降の (instances ...))
+	excluded: bool              # DNP または BOMから除外
+
+
+@dataclass
+class SchSheet:
+	uuid: str
+	file: str
+	name: str
+	excluded: bool
+
+
+@dataclass
+class SchFile:
+	uuid: str = ''
+	symbols: List[SchSymbol] = field(default_factory=list)
+	sheets: List[SchSheet] = field(default_factory=list)
+	legacy_refs: Dict[str, str] = field(default_factory=dict)  # KiCad 6 の (symbol_instances ...)
+
+
+def _atom(node: Optional[list], index: int = 1, default: str = '') -> str:
+	if node is None or len(node) <= index or isinstance(node[index], list):
+		return default
+	return node[index]
+
+
+def _flag(node: list, key: str, default: str) -> str:
+	return _atom(find(node, key), 1, default)
+
+
+def _excluded(node: list) -> bool:
+	return _flag(node, 'in_bom', 'yes') == 'no' or _flag(node, 'dnp', 'no') == 'yes'
+
+
+def _properties(node: list) -> Dict[str, str]:
+	return {_atom(p): _atom(p, 2) for p in find_all(node, 'property')}
+
+
+def _instance_refs(node: list) -> Dict[str, str]:
+	# (instances (project "名前" (path "/uuid/..." (reference "R1") (unit 1))))
+	refs: Dict[str, str] = {}
+	instances = find(node, 'instances')
+	if instances is None:
+		return refs
+	for project in find_all(instances, 'project'):
+		for path in find_all(project, 'path'):
+			refs[_atom(path)] = _atom(find(path, 'reference'))
+	return refs
+
+
+def parse_schematic(path: str) -> SchFile:
+	"""1シート分のシンボルとサブシートを返す (サブシートの中身は読まない)"""
+	sch = SchFile()
+	with open(path, encoding='utf-8') as f:
+		for node in kicad_sexpr.iter_nodes(f, depth=1):
+			if not node:
+				continue
+			head = node[0]
+			if head == 'uuid':
+				sch.uuid = _atom(node)
+			elif head == 'symbol':
+				props = _properties(node)
+				sch.symbols.append(SchSymbol(
+					lib_id=_atom(find(node, 'lib_id')),
+					uuid=_atom(find(node, 'uuid')),
+					fields=props,
+					references=_instance_refs(node),
+					excluded=_excluded(node),
+				))
+			elif head == 'sheet':
+				props = _properties(node)
+				sch.sheets.append(SchSheet(
+					uuid=_atom(find(node, 'uuid')),
+					# KiCad 6 は "Sheet file"、7 以降は "Sheetfile"
+					file=props.get('Sheetfile') or props.get('Sheet file', ''),
+					name=props.get('Sheetname') or props.get('Sheet name', ''),
+					excluded=_excluded(node),
+				))
+			elif head == 'symbol_instances':
+				for p in find_all(node, 'path'):
+					sch.legacy_refs[_atom(p)] = _atom(find(p, 'reference'))
+	return sch
+
+
+def _parse_safe(path: str) -> Tuple[str, Optional[SchFile], Optional[str]]:
+	# プロセスプールから呼ぶ用
+	try:
+		return path, parse_schematic(path), None
+	except (OSError, UnicodeError) as e:
+		return path, None, str(e)
+
+
+def load_hierarchy(root: str, executor: Optional[Executor] = None) -> Dict[str, SchFile]:
+	"""ルートシートから辿れる全シートファイルを解析する。{正規化したパス: SchFile}
+
+	executor (ProcessPoolExecutor など) を渡すとシートファイルごとに並列に解析する。
+	プールの起動は重い (Windows では各ワーカーが import し直す) ので、複数の回路図を読む場合は
+	呼び出し側で1つ作って使い回す。省略時はこのプロセスで順に解析する。
+	"""
+	root = os.path.normpath(os.path.abspath(root))
+	parsed: Dict[str, SchFile] = {}
+	submitted = {root}
+
+	def add(path: str, sch: Optional[SchFile], error: Optional[str]) -> List[str]:
+		if sch is None:
+			raise ValueError(f"回路図を読み込めません: {path}\n{error}")
+		parsed[path] = sch
+		# 見つかったサブシート (同じファイルは1回だけ)
+		children = []
+		for sheet in sch.sheets:
+			child = os.path.normpath(os.path.join(os.path.dirname(path), sheet.file))
+			if sheet.file and child not in submitted:
+				submitted.add(child)
+				children.append(child)
+		return children
+
+	if executor is None:
+		queue = [root]
+		while queue:
+			queue.extend(add(*_parse_safe(queue.pop())))
+		return parsed
+
+	pending = {executor.submit(_parse_safe, root)}
+	try:
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				for child in add(*future.result()):
+					pending.add(executor.submit(_parse_safe, child))
+	finally:
+		# エラー時は残りを捨てる (共有のプールなので shutdown はしない)
+		for future in pending:
+			future.cancel()
+	return parsed
+
+
+def schematic_bom(root: str, executor: Optional[Executor] = None) -> Tuple[List[str], List[Dict[str, str]], List[str]]:
+	"""階層を展開した部品の一覧を返す。戻り値は (列名, 行のリスト, 読んだシートファイル)。行は部品1個 (Qty=1)
+
+	読んだシートファイルの一覧は、キャッシュの有効性 (サブシートだけ編集された場合) の確認用。
+
+	DNP / BOMから除外の部品とシート、電源シンボル (#PWR など) は含めない。
+	複数ユニットの部品はリファレンスごとに1個として数える。
+	"""
+	root = os.path.normpath(os.path.abspath(root))
+	files = load_hierarchy(root, executor)
+	root_sch = files[root]
+	legacy_refs = root_sch.legacy_refs
+
+	rows: List[Dict[str, str]] = []
+	extra_fields: Dict[str, None] = {}  # 出てきた順の追加フィールド名
+	seen = set()
+
+	def walk(path: str, sheet_path: str, legacy_path: str, stack: Tuple[str, ...]) -> None:
+		sch = files[path]
+		for sym in sch.symbols:
+			if sym.excluded:
+				continue
+			# KiCad 7以降は "/ルートuuid/シートuuid..."、KiCad 6 は "/シートuuid.../シンボルuuid"
+			ref = (sym.references.get(sheet_path)
+			       or legacy_refs.get(f"{legacy_path}/{sym.uuid}")
+			       or sym.fields.get('Reference', ''))
+			if not ref or ref.startswith('#'):
+				continue
+			key = (sheet_path, ref) if not ref.endswith('?') else (sheet_path, sym.uuid)
+			if key in seen:
+				continue  # 複数ユニットの2つ目以降
+			seen.add(key)
+			row = dict(sym.fields)
+			row['Reference'] = ref
+			for name in row:
+				if name not in BASE_FIELDS:
+					extra_fields.setdefault(name)
+			rows.append(row)
+		for sheet in sch.sheets:
+			if sheet.excluded or not sheet.file:
+				continue
+			child = os.path.normpath(os.path.join(os.path.dirname(path), sheet.file))
+			if child in stack:
+				raise ValueError(f"シートの参照が循環しています: {sheet.file}")
+			walk(child, f"{sheet_path}/{sheet.uuid}", f"{legacy_path}/{sheet.uuid}", stack + (child,))
+
+	walk(root, f"/{root_sch.uuid}", '', (root,))
+
+	columns = list(BASE_FIELDS) + [n for n in extra_fields if n != QTY_COLUMN] + [QTY_COLUMN]
+	for row in rows:
+		row[QTY_COLUMN] = 1
+	return columns, rows, sorted(files)
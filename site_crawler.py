@@ -0,0 +1,295 @@
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# translate_page.py のページ/画像取得部分 (翻訳とは独立して使えるように分離)
+# 1つの Session を使い回してコネクションを再利用し、ホストごとに同時接続数と間隔を制限する。
+# 取得はスレッドプールで先読みし、呼び出し側 (翻訳) は取得済みのページを順に受け取るだけにする。
+
+TIMEOUT = 10
+PER_HOST = 2         # 同じホストへの同時接続数
+INTERVAL = 0.5       # 同じホストへのリクエスト開始間隔 (秒)
+WORKERS = 8
+PREFETCH = 16        # 翻訳を待たずに先に取得しておくページ数の上限
+RETRIES = 2
+RETRY_STATUS = {429, 500, 502, 503, 504}
+USER_AGENT = 'Mozilla/5.0 (compatible; translate_page)'
+STATE_VERSION = 1
+SAVE_EVERY = 20      # 状態ファイルを書き出す間隔 (処理したページ数)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class HostLimiter:
+    """ホストごとの同時接続数とリクエスト開始間隔を守る"""
+
+    def __init__(self, per_host=PER_HOST, interval=INTERVAL):
+        self.per_host = per_host
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._next_start = {}
+
+    @contextmanager
+    def slot(self, host):
+        with self._lock:
+            sem = self._slots.get(host)
+            if sem is None:
+                sem = self._slots[host] = threading.Semaphore(self.per_host)
+        with sem:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, 0.0))
+                self._next_start[host] = start + self.interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+    def delay(self, host, seconds):
+        """429 などで待つように言われた場合、そのホストへの次の開始を遅らせる"""
+        with self._lock:
+            self._next_start[host] = max(self._next_start.get(host, 0.0), time.monotonic() + seconds)
+
+
+def make_session(pool_size=WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+class Fetcher:
+    """keep-alive の Session とホストごとの制限付きで GET する (スレッドから同時に呼んでよい)"""
+
+    def __init__(self, per_host=PER_HOST, interval=INTERVAL, timeout=TIMEOUT, retries=RETRIES, session=None):
+        self.session = session or make_session(max(WORKERS, per_host))
+        self.limiter = HostLimiter(per_host, interval)
+        self.timeout = timeout
+        self.retries = retries
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Response を返す。失敗したら requests.RequestException を送出する"""
+        host = urlparse(url).netloc
+        for attempt in range(self.retries + 1):
+            with self.limiter.slot(host):
+                response = self.session.get(url, timeout=self.timeout)
+            with self._lock:
+                self.requests += 1
+                self.bytes += len(response.content)
+            if response.status_code in RETRY_STATUS and attempt < self.retries:
+                retry_after = response.headers.get('Retry-After', '')
+                self.limiter.delay(host, float(retry_after) if retry_after.isdigit() else 2.0 ** (attempt + 1))
+                continue
+            response.raise_for_status()
+            return response
+        raise requests.RequestException(f"リトライ上限: {url}")
+
+    def get_text(self, url):
+        try:
+            return self.get(url).text
+        except requests.RequestException as e:
+            print(f"  [Error] ページ取得失敗: {url} ({e})")
+            return None
+
+    def get_bytes(self, url):
+        return self.get(url).content
+
+    def close(self):
+        self.session.close()
+
+
+def canonical_url(url):
+    """取得に使うURL: フラグメントを除き、ホスト名を小文字に、既定のポートを省き、クエリを並べ替える"""
+    parts = urlparse(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        host = f"[{host}]"  # IPv6 アドレスは hostname で括弧が外れるので戻す
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunparse((scheme, host, parts.path or '/', parts.params, query, ''))
+
+
+def url_key(url):
+    """重複判定用のキー (末尾のスラッシュの有無は同じページとみなす)"""
+    canonical = canonical_url(url)
+    parts = urlparse(canonical)
+    return urlunparse(parts._replace(path=parts.path.rstrip('/') or '/'))
+
+
+class Frontier:
+    """これから取得するURLの待ち行列と、処理済みURLの集合
+
+    重複判定は正規化したURLのハッシュ集合で行う。priority(url, depth) を渡すと
+    値の小さいものから取り出す (省略時は見つかった順)。max_depth を超えるリンクは追加しない。
+    state_path を渡すと待ち行列と処理済みの集合を保存し、次回はその続きから再開する。
+    """
+
+    def __init__(self, max_depth=None, priority=None, state_path=None):
+        self.max_depth = max_depth
+        self.priority = priority
+        self.state_path = state_path
+        self._queue = deque()
+        self._heap = []
+        self._counter = 0
+        self.seen = set()
+        self.done = set()
+        self.failed = {}
+        self.in_flight = {}
+        self._since_save = 0
+        if state_path and os.path.exists(state_path):
+            self.load()
+
+    def __len__(self):
+        return len(self._heap) if self.priority else len(self._queue)
+
+    def push(self, url, depth=0, force=False):
+        """未知のURLなら追加して True を返す"""
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        key = url_key(url)
+        if key in self.seen and not force:
+            return False
+        self.seen.add(key)
+        url = canonical_url(url)
+        if self.priority:
+            heapq.heappush(self._heap, (self.priority(url, depth), self._counter, url, depth))
+            self._counter += 1
+        else:
+            self._queue.append((url, depth))
+        return True
+
+    def pop(self):
+        if self.priority:
+            _, _, url, depth = heapq.heappop(self._heap)
+        else:
+            url, depth = self._queue.popleft()
+        self.in_flight[url] = depth
+        return url, depth
+
+    def mark_done(self, url):
+        self.in_flight.pop(url, None)
+        self.done.add(url_key(url))
+        self._maybe_save()
+
+    def mark_failed(self, url):
+        depth = self.in_flight.pop(url, 0)
+        self.failed[url] = depth  # 次回の再開時にもう一度試す
+        self._maybe_save()
+
+    def _maybe_save(self):
+        self._since_save += 1
+        if self.state_path and self._since_save >= SAVE_EVERY:
+            self.save()
+
+    def pending(self):
+        """待ち行列 + 取得中 + 失敗したもの ((url, depth) のリスト)"""
+        queued = [(u, d) for _, _, u, d in sorted(self._heap)] if self.priority else list(self._queue)
+        return list(self.in_flight.items()) + queued + list(self.failed.items())
+
+    def save(self):
+        self._since_save = 0
+        state = {'version': STATE_VERSION, 'done': sorted(self.done), 'pending': self.pending()}
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.crawl-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp, self.state_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def load(self):
+        with open(self.state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('version') != STATE_VERSION:
+            return
+        self.done = set(state['done'])
+        self.seen = set(self.done)
+        for url, depth in state['pending']:
+            self.push(url, depth)
+
+
+class Crawler:
+    """リンクをたどりながらページを並列に取得し、取得できた順に (url, html) を返す
+
+    extract_links(html, url) はページ内のたどるべきURLのリストを返す関数。
+    先読みは prefetch ページまでなので、呼び出し側の処理が遅ければ取得も止まって待つ。
+    呼び出し側が次のページを要求した時点で、前に返したページを処理済みとして frontier に記録する。
+    auto_done=False の場合は記録しないので、呼び出し側が処理を終えた時点で frontier.mark_done() を呼ぶ
+    (何ページかまとめて処理する場合用)。
+    known_links(url) が None 以外 (保存済みのリンク一覧) を返すページは取得せず、呼び出し側にも返さない。
+    """
+
+    def __init__(self, fetcher, extract_links, workers=WORKERS, prefetch=PREFETCH, frontier=None, known_links=None,
+                 auto_done=True):
+        self.fetcher = fetcher
+        self.extract_links = extract_links
+        self.workers = workers
+        self.prefetch = max(prefetch, workers)
+        self.frontier = frontier if frontier is not None else Frontier()
+        self.known_links = known_links
+        self.auto_done = auto_done
+        self.skipped = 0
+
+    def _fetch(self, url):
+        # ワーカースレッドで実行。保存済みのリンクがあればネットワークに出ない
+        if self.known_links is not None:
+            links = self.known_links(url)
+            if links is not None:
+                return None, links
+        html = self.fetcher.get_text(url)
+        return html, None
+
+    def crawl(self, start_urls):
+        frontier = self.frontier
+        for url in start_urls:
+            frontier.push(url, 0)
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        pending = {}
+        try:
+            while len(frontier) or pending:
+                while len(frontier) and len(pending) < self.prefetch:
+                    url, depth = frontier.pop()
+                    pending[pool.submit(self._fetch, url)] = (url, depth)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = pending.pop(future)
+                    html, links = future.result()
+                    if links is not None:
+                        for link in links:
+                            frontier.push(link, depth + 1)
+                        self.skipped += 1
+                        frontier.mark_done(url)
+                        continue
+                    if html is None:
+                        frontier.mark_failed(url)
+                        continue
+                    for link in self.extract_links(html, url):
+                        frontier.push(link, depth + 1)
+                    yield url, html
+                    if self.auto_done:
+                        frontier.mark_done(url)
+        finally:
+            # 途中で打ち切られた場合 (上限到達など) は未着手の取得を捨てる。
+            # 取得中/未処理のページは待ち行列に残したまま保存されるので、次回そこから再開する
+            pool.shutdown(wait=False, cancel_futures=True)
+            if frontier.state_path:
+                frontier.save()
@@ -0,0 +1,243 @@
+from pathlib import Path
+import argparse
+import mmap
+import os
+import re
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Iterator, BinaryIO
+
+import kicad_sexpr
+
+# 巨大な .kicad_sym をメモリマップして、トップレベルの (symbol ...) の範囲だけを括弧の対応から探す
+# ツリーは作らないので、メモリ使用量は最大のシンボル1つ分程度に収まる
+
+# 文字列 (中の括弧は数えない) と括弧だけを拾う。それ以外の文字は正規表現エンジンの中で読み飛ばす
+_SCAN_RE = re.compile(rb'"(?:[^"\\]|\\.)*"|[()]', re.S)
+_HEAD_RE = re.compile(rb'\(\s*([^\s()"]+)\s*(?:"((?:[^"\\]|\\.)*)"|([^\s()"]+))?', re.S)
+_EXTENDS_RE = re.compile(rb'\(\s*extends\s+(?:"((?:[^"\\]|\\.)*)"|([^\s()"]+))', re.S)
+
+OPEN = ord('(')
+
+
+@dataclass
+class Span:
+	kind: str            # symbol / version / generator ...
+	name: Optional[str]  # (symbol "名前" ...) の名前
+	start: int
+	end: int             # buf[start:end] が "(...)" 全体
+
+	@property
+	def size(self) -> int:
+		return self.end - self.start
+
+
+def _decode(raw: Optional[bytes]) -> Optional[str]:
+	if raw is None:
+		return None
+	return kicad_sexpr.unescape(raw.decode('utf-8', errors='replace'))
+
+
+def iter_spans(buf) -> Iterator[Span]:
+	"""ルート直下の (xxx ...) の範囲を順に返す"""
+	depth = 0
+	start = 0
+	for m in _SCAN_RE.finditer(buf):
+		c = buf[m.start()]
+		if c == OPEN:
+			depth += 1
+			if depth == 2:
+				start = m.start()
+		elif m.end() - m.start() == 1:  # ) (文字列は必ず2文字以上)
+			if depth == 2:
+				end = m.end()
+				head = _HEAD_RE.match(buf, start, min(end, start + 4096))
+				if head:
+					kind = head.group(1).decode('ascii', errors='replace')
+					name = _decode(head.group(2) if head.group(2) is not None else head.group(3))
+				else:
+					kind, name = '', None
+				yield Span(kind, name if kind == 'symbol' else None, start, end)
+			if depth > 0:
+				depth -= 1
+
+
+def extends_of(buf, span: Span) -> Optional[str]:
+	"""派生シンボル (extends "親") の親の名前。(extends ...) はシンボルの先頭付近にある"""
+	head_end = min(span.end, span.start + 4096)
+	m = _EXTENDS_RE.search(buf, span.start, head_end)
+	if not m:
+		return None
+	return _decode(m.group(1) if m.group(1) is not None else m.group(2))
+
+
+class SymbolLib:
+	def __init__(self, path):
+		self.path = Path(path)
+		self._file = open(self.path, 'rb')
+		try:
+			# 0バイトのファイルはメモリマップできない
+			if os.fstat(self._file.fileno()).st_size == 0:
+				raise ValueError(f"空のファイルです: {self.path}")
+			self.buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		except BaseException:
+			self._file.close()
+			raise
+		self.header: List[Span] = []
+		self.symbols: List[Span] = []
+		for span in iter_spans(self.buf):
+			(self.symbols if span.kind == 'symbol' else self.header).append(span)
+
+	def close(self) -> None:
+		self.buf.close()
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def root_tag(self) -> bytes:
+		m = _HEAD_RE.match(self.buf, self.buf.find(b'('))
+		return m.group(1) if m else b'kicad_symbol_lib'
+
+	def write_lib(self, out: BinaryIO, spans: List[Span]) -> None:
+		"""ヘッダー (version/generator) と指定のシンボルだけの .kicad_sym を書く"""
+		out.write(b'(' + self.root_tag() + b'\n')
+		for span in self.header:
+			out.write(b'\t' + self.buf[span.start:span.end] + b'\n')
+		for span in spans:
+			# 1シンボル分ずつコピーする
+			out.write(b'\t' + self.buf[span.start:span.end] + b'\n')
+		out.write(b')\n')
+
+	def with_bases(self, spans: List[Span]) -> List[Span]:
+		"""派生シンボルの親も含めて、元の順番で返す (KiCad は親が同じライブラリに必要)"""
+		by_name = {s.name: s for s in self.symbols}
+		wanted = {s.name for s in spans}
+		stack = list(spans)
+		while stack:
+			base = extends_of(self.buf, stack.pop())
+			if base and base not in wanted and base in by_name:
+				wanted.add(base)
+				stack.append(by_name[base])
+		return [s for s in self.symbols if s.name in wanted]
+
+
+def family_of(name: str, pattern: re.Pattern) -> str:
+	m = pattern.search(name)
+	if not m:
+		return 'other'
+	family = m.group(1) if m.groups() and m.group(1) else m.group(0)
+	return re.sub(r'[^\w.-]+', '_', family) or 'other'
+
+
+def plan_split(lib: SymbolLib, pattern: re.Pattern, max_symbols: int = 0) -> Dict[str, List[Span]]:
+	"""シンボルをファミリーごとに分ける。派生シンボルは親と同じファミリーにする"""
+	family_by_name: Dict[str, str] = {}
+	groups: Dict[str, List[Span]] = OrderedDict()
+	for span in lib.symbols:
+		base = extends_of(lib.buf, span)
+		family = family_by_name.get(base) if base else None
+		if family is None:
+			if base:
+				print(f"[警告] {span.name}: 親 {base} が先に見つからないため単独で分類します")
+			family = family_of(span.name or '', pattern)
+		family_by_name[span.name] = family
+		groups.setdefault(family, []).append(span)
+
+	if max_symbols <= 0:
+		return groups
+
+	# 大きすぎるファミリーは連番で分割する。親とその派生シンボル (孫も含む) はまとめて1単位として扱い、
+	# 途中で分けない (親の無いライブラリは KiCad で読めない)
+	result: Dict[str, List[Span]] = OrderedDict()
+	for family, spans in groups.items():
+		if len(spans) <= max_symbols:
+			result[family] = spans
+			continue
+		root_by_name: Dict[str, str] = {}
+		units: Dict[str, List[Span]] = OrderedDict()
+		for span in spans:
+			base = extends_of(lib.buf, span)
+			root = root_by_name.get(base, span.name) if base else span.name
+			root_by_name[span.name] = root
+			units.setdefault(root, []).append(span)
+		part: List[Span] = []
+		index = 1
+		for unit in units.values():
+			if part and len(part) + len(unit) > max_symbols:
+				result[f"{family}_{index}"] = sorted(part, key=lambda s: s.start)
+				index += 1
+				part = []
+			part.extend(unit)  # 1単位で max_symbols を超える場合はそのまま1ファイルにする
+		if part:
+			result[f"{family}_{index}"] = sorted(part, key=lambda s: s.start)
+	return result
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='巨大な .kicad_sym の一覧/抽出/分割 (メモリマップで読む)')
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	p_list = sub.add_parser('list', help='シンボル名と位置/サイズを表示')
+	p_list.add_argument('lib')
+
+	p_extract = sub.add_parser('extract', help='指定したシンボル (と派生元) だけのライブラリを作る')
+	p_extract.add_argument('lib')
+	p_extract.add_argument('names', nargs='+', help='シンボル名 (正規表現は --regex)')
+	p_extract.add_argument('-o', '--output', required=True)
+	p_extract.add_argument('--regex', action='store_true', help='names を正規表現として扱う')
+
+	p_split = sub.add_parser('split', help='ファミリーごとの小さなライブラリに分割する')
+	p_split.add_argument('lib')
+	p_split.add_argument('-o', '--output-dir', required=True)
+	p_split.add_argument('--pattern', default=r'^[A-Za-z]+', help='ファミリー名を取り出す正規表現 (グループ1があればそれを使う)')
+	p_split.add_argument('--max-symbols', type=int, default=0, help='1ライブラリあたりの最大シンボル数 (0なら無制限)')
+	p_split.add_argument('--prefix', default='', help='出力ファイル名の接頭辞 (既定: 元のライブラリ名_)')
+	args = parser.parse_args()
+
+	try:
+		lib = SymbolLib(args.lib)
+	except (OSError, ValueError) as e:
+		print(f"エラー: {e}", file=sys.stderr)
+		sys.exit(2)
+
+	with lib:
+		if args.command == 'list':
+			for span in lib.symbols:
+				base = extends_of(lib.buf, span)
+				print(f"{span.name}\t{span.start}\t{span.size}" + (f"\textends {base}" if base else ''))
+			print(f"{len(lib.symbols)} シンボル", file=sys.stderr)
+
+		elif args.command == 'extract':
+			if args.regex:
+				patterns = [re.compile(n) for n in args.names]
+				spans = [s for s in lib.symbols if any(p.search(s.name or '') for p in patterns)]
+			else:
+				names = set(args.names)
+				spans = [s for s in lib.symbols if s.name in names]
+				missing = names - {s.name for s in spans}
+				for n in sorted(missing):
+					print(f"[警告] 見つかりません: {n}", file=sys.stderr)
+			spans = lib.with_bases(spans)
+			with open(args.output, 'wb') as out:
+				lib.write_lib(out, spans)
+			print(f"{len(spans)} シンボルを書き出しました: {args.output}")
+
+		else:
+			out_dir = Path(args.output_dir)
+			out_dir.mkdir(parents=True, exist_ok=True)
+			prefix = args.prefix or lib.path.stem + '_'
+			groups = plan_split(lib, re.compile(args.pattern), args.max_symbols)
+			for family, spans in groups.items():
+				path = out_dir / f"{prefix}{family}.kicad_sym"
+				with open(path, 'wb') as out:
+					lib.write_lib(out, spans)
+				print(f"{path}: {len(spans)} シンボル")
+
+
+if __name__ == "__main__":
+	main()
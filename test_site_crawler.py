@@ -0,0 +1,136 @@
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from site_crawler import Crawler, Fetcher, Frontier
+
+# site_crawler の取得部分をローカルの HTTP サーバーに対して確かめる
+# 使い方: python -m unittest test_site_crawler (pytest でも可)
+
+# /x86/a -> b, c / b -> d / c -> d (d は重複)
+PAGES = {
+    '/x86/a': ['/x86/b', '/x86/c'],
+    '/x86/b': ['/x86/d'],
+    '/x86/c': ['/x86/d'],
+    '/x86/d': [],
+}
+SLOW = 0.1  # /slow/ 以下の応答にかける秒数
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive (接続の使い回しを確かめるため)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.starts.append(time.monotonic())
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            server.connections.add(self.client_address)
+        try:
+            if self.path.startswith('/slow/'):
+                time.sleep(SLOW)
+                body = b'ok'
+            elif self.path in PAGES:
+                body = ''.join(f'<a href="{link}">{link}</a>' for link in PAGES[self.path]).encode()
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def _links(html, url):
+    base = url.split('/x86/')[0]
+    return [base + href for href in re.findall(r'href="([^"]+)"', html)]
+
+
+class FetchPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.active = 0
+        self.server.max_active = 0
+        self.server.starts = []
+        self.server.hits = {}
+        self.server.connections = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_per_host_limits(self):
+        fetcher = Fetcher(per_host=2, interval=0.05)
+        threads = [threading.Thread(target=fetcher.get_text, args=(f'{self.base}/slow/{i}',)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        fetcher.close()
+
+        self.assertEqual(fetcher.requests, 6)
+        self.assertLessEqual(self.server.max_active, 2)
+        starts = sorted(self.server.starts)
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        self.assertGreaterEqual(min(gaps), 0.05 * 0.8)  # タイマーの誤差分だけ緩める
+
+    def test_session_reused(self):
+        fetcher = Fetcher(per_host=1, interval=0)
+        for path in PAGES:
+            self.assertIsNotNone(fetcher.get_text(self.base + path))
+        fetcher.close()
+        # 1本の keep-alive 接続で全部取得している
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_resume_from_state_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state = os.path.join(tmp, 'state.json')
+            start = [self.base + '/x86/a']
+
+            # 1回目: 2ページ受け取ったところで打ち切る (2ページ目は処理済みにならない)
+            fetcher = Fetcher(interval=0)
+            first = []
+            for url, _html in Crawler(fetcher, _links, workers=1, prefetch=1,
+                                      frontier=Frontier(state_path=state)).crawl(start):
+                first.append(url)
+                if len(first) == 2:
+                    break
+            fetcher.close()
+            self.assertTrue(os.path.exists(state))
+
+            # 2回目: 状態ファイルから再開して残りを取得する
+            fetcher = Fetcher(interval=0)
+            frontier = Frontier(state_path=state)
+            second = [url for url, _html in Crawler(fetcher, _links, workers=1, prefetch=1,
+                                                    frontier=frontier).crawl(start)]
+            fetcher.close()
+
+        everything = {self.base + path for path in PAGES}
+        self.assertEqual(set(first) | set(second), everything)
+        self.assertNotIn(first[0], second)       # 処理済みのページはやり直さない
+        self.assertIn(first[1], second)          # 処理中だったページはやり直す
+        self.assertEqual(len(second), len(set(second)))
+        self.assertEqual(self.server.hits['/x86/a'], 1)
+        self.assertEqual(self.server.hits['/x86/d'], 1)
+        self.assertEqual({u.rstrip('/') for u in frontier.done}, everything)
+
+
+if __name__ == '__main__':
+    unittest.main()
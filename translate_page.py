@@ -2,21 +2,45 @@ import sys
 import os
 import argparse
 import time
-import requests
 import re
 import json
+import html
+import hashlib
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import html2text
 import google.generativeai as genai
 import markdown
 
+import site_crawler
+from site_crawler import Crawler, Fetcher, Frontier
+from translation_cache import TranslationCache
+
 # --- 設定 ---
 API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = 'gemini-2.0-flash'
 OUTPUT_DIR = "translated_site"
 CSS_FILENAME = "style.css"
+STATE_FILENAME = ".crawl_state.json"
+META_SUFFIX = ".links.json"  # 翻訳済みページの横に置くリンク一覧とメタデータ
+CACHE_FILENAME = ".translation_cache.sqlite"
+# プロンプトを変えたら上げる (古いキャッシュを使わないように)
+CONTENT_PROMPT_VERSION = 1
+SVG_PROMPT_VERSION = 1
 CHUNK_SIZE = 12000
+# SVGのテキストは1リクエストにこの文字数 (JSON) / 件数までまとめて送る
+SVG_BATCH_CHARS = 6000
+SVG_BATCH_ITEMS = 300
+IMAGE_WORKERS = 4
+UNWANTED_TAGS = ['script', 'style', 'nav', 'footer']  # 変換前に取り除く要素 (リンクもたどらない)
+
+# ページと画像の取得 (main でオプションに合わせて作り直す)
+fetcher = Fetcher()
+# 翻訳結果のキャッシュ (main で開く。None ならキャッシュしない)
+translation_cache = None
+api_calls = 0
 
 # ★CSS変更点: codeタグの背景色を削除(transparent)にしました
 RAW_CSS = """
@@ -107,12 +131,6 @@ a:hover { text-decoration: underline; }
 }
 """
 
-if not API_KEY:
-    print("エラー: 環境変数 GEMINI_API_KEY が設定されていません。")
-    sys.exit(1)
-
-genai.configure(api_key=API_KEY)
-
 def setup_css_file():
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
@@ -120,15 +138,6 @@ def setup_css_file():
     with open(css_path, 'w', encoding='utf-8') as f:
         f.write(RAW_CSS)
 
-def get_html(url):
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.text
-    except Exception as e:
-        print(f"  [Error] ページ取得失敗: {url} ({e})")
-        return None
-
 def get_save_path_base(url):
     parsed = urlparse(url)
     path = parsed.path.lstrip('/')
@@ -149,10 +158,9 @@ def download_and_process_image(img_tag, base_url, current_html_dir):
     if not os.path.exists(img_save_full_path):
         try:
             os.makedirs(os.path.dirname(img_save_full_path), exist_ok=True)
-            resp = requests.get(img_abs_url, timeout=10)
-            resp.raise_for_status()
+            content = fetcher.get_bytes(img_abs_url)
             with open(img_save_full_path, 'wb') as f:
-                f.write(resp.content)
+                f.write(content)
         except Exception as e:
             print(f"    [Image Error] {src}: {e}")
             return
@@ -162,8 +170,58 @@ def download_and_process_image(img_tag, base_url, current_html_dir):
     img_tag['src'] = rel_path_for_html
     if img_tag.has_attr('srcset'): del img_tag['srcset']
 
+def generate(model, prompt):
+    global api_calls
+    api_calls += 1
+    return model.generate_content(prompt)
+
 def translate_list_batch(text_list):
     if not text_list: return []
+
+    # キャッシュに無いフレーズだけを (重複を除いて) APIに送る
+    cached = {}
+    if translation_cache is not None:
+        for text in dict.fromkeys(text_list):
+            result = translation_cache.get('svg', SVG_PROMPT_VERSION, text)
+            if result is not None:
+                cached[text] = result
+    missing = [t for t in dict.fromkeys(text_list) if t not in cached]
+    if not missing:
+        return [cached[t] for t in text_list]
+
+    for batch in pack_phrases(missing):
+        cached.update(zip(batch, _translate_phrases_retry(batch)))
+    return [cached.get(t, t) for t in text_list]
+
+def pack_phrases(texts, max_chars=SVG_BATCH_CHARS, max_items=SVG_BATCH_ITEMS):
+    """フレーズを1リクエストに収まる大きさのバッチに詰める"""
+    batch, size = [], 2
+    for text in texts:
+        n = len(json.dumps(text, ensure_ascii=False)) + 2
+        if batch and (size + n > max_chars or len(batch) >= max_items):
+            yield batch
+            batch, size = [], 2
+        batch.append(text)
+        size += n
+    if batch:
+        yield batch
+
+class _LengthMismatch(Exception):
+    pass
+
+def _translate_phrases_retry(text_list):
+    """件数が合わない/JSONが壊れている場合は半分に分けて翻訳し直す (1件でも失敗したら原文のまま)"""
+    try:
+        return _translate_phrases(text_list)
+    except _LengthMismatch as e:
+        if len(text_list) == 1:
+            print(f"    [Error] SVGテキスト翻訳失敗: {e}")
+            return text_list
+        half = len(text_list) // 2
+        print(f"    [Retry] SVGテキストの件数が合わないため分割して再翻訳 ({len(text_list)} -> {half} + {len(text_list) - half})")
+        return _translate_phrases_retry(text_list[:half]) + _translate_phrases_retry(text_list[half:])
+
+def _translate_phrases(text_list):
     json_text = json.dumps(text_list, ensure_ascii=False)
     
     model = genai.GenerativeModel(MODEL_NAME)
@@ -179,44 +237,43 @@ def translate_list_batch(text_list):
 {json_text}
     """
     try:
-        response = model.generate_content(prompt)
-        cleaned = response.text.strip()
-        if cleaned.startswith("```"):
-            cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', cleaned)
-        translated_list = json.loads(cleaned)
-        if len(translated_list) != len(text_list):
-            return text_list
-        return translated_list
+        cleaned = generate(model, prompt).text.strip()
     except Exception as e:
         print(f"    [Error] SVGテキスト翻訳失敗: {e}")
         return text_list
 
-def process_and_translate_svgs(soup):
-    svgs = soup.find_all('svg')
-    if not svgs: return
-    print(f"  [Info] SVG画像の内部テキストを翻訳中 ({len(svgs)}個)...")
-
-    for i, svg in enumerate(svgs):
-        target_nodes = []
-        original_texts = []
+    if cleaned.startswith("```"):
+        cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', cleaned)
+    try:
+        translated_list = json.loads(cleaned)
+    except ValueError as e:
+        raise _LengthMismatch(f"JSONとして読めません: {e}")
+    if not isinstance(translated_list, list) or len(translated_list) != len(text_list):
+        raise _LengthMismatch(f"件数が一致しません ({len(text_list)} 件)")
+    translated_list = [str(t) for t in translated_list]
+    if translation_cache is not None:
+        translation_cache.put_many('svg', SVG_PROMPT_VERSION, zip(text_list, translated_list))
+    return translated_list
+
+def svg_text_nodes(soup):
+    """ページ内の全 <svg> の、翻訳対象のテキストを持つ <text>/<tspan>"""
+    nodes = []
+    for svg in soup.find_all('svg'):
         for text_tag in svg.find_all(['text', 'tspan']):
             if text_tag.string and text_tag.string.strip():
-                target_nodes.append(text_tag)
-                original_texts.append(text_tag.string.strip())
-        
-        if not original_texts: continue
-        translated_texts = translate_list_batch(original_texts)
-        for node, trans_text in zip(target_nodes, translated_texts):
-            node.string.replace_with(trans_text)
-
-def convert_to_hybrid_md(html_content, base_url):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    for element in soup(['script', 'style', 'nav', 'footer']):
-        element.decompose()
-
-    current_base_path = get_save_path_base(base_url)
-    current_page_dir = os.path.dirname(current_base_path)
-
+                nodes.append(text_tag)
+    return nodes
+
+def translate_svg_nodes(nodes):
+    """SVGのテキストをまとめて翻訳して書き戻す (<svg> ごとではなく、渡された全ノードで重複を除いて送る)"""
+    if not nodes: return
+    original_texts = [node.string.strip() for node in nodes]
+    print(f"  [Info] SVG画像の内部テキストを翻訳中 ({len(nodes)}個, {len(set(original_texts))}種類)...")
+    translated_texts = translate_list_batch(original_texts)
+    for node, trans_text in zip(nodes, translated_texts):
+        node.string.replace_with(trans_text)
+
+def _links_in(soup, base_url):
     extracted_links = []
     for a in soup.find_all('a', href=True):
         href = a['href']
@@ -225,6 +282,31 @@ def convert_to_hybrid_md(html_content, base_url):
         parsed_target = urlparse(full_url)
         if parsed_base.netloc == parsed_target.netloc and '/x86/' in parsed_target.path and '#' not in href: 
             extracted_links.append(full_url)
+    return extracted_links
+
+def _remove_unwanted(soup):
+    for element in soup(UNWANTED_TAGS):
+        element.decompose()
+
+def extract_links(html_content, base_url):
+    """たどるべきリンクだけを取り出す (クローラー用)
+
+    prepare_soup() と同じく nav/footer 内のリンクは除く (保存するリンク一覧と同じになるように)。
+    <a> と、それを含むかもしれない nav/footer 以外は解析しない。
+    """
+    soup = BeautifulSoup(html_content, 'html.parser', parse_only=SoupStrainer(['a', 'nav', 'footer']))
+    _remove_unwanted(soup)
+    return _links_in(soup, base_url)
+
+def prepare_soup(html_content, base_url):
+    """不要な要素の削除、リンクの書き換え、画像の取得まで (SVGの翻訳はしない)"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    _remove_unwanted(soup)
+
+    current_base_path = get_save_path_base(base_url)
+    current_page_dir = os.path.dirname(current_base_path)
+
+    extracted_links = _links_in(soup, base_url)
 
     for a in soup.find_all('a', href=True):
         href = a['href']
@@ -240,11 +322,15 @@ def convert_to_hybrid_md(html_content, base_url):
                 new_href += f"#{parsed_target.fragment}"
             a['href'] = new_href
 
-    for img in soup.find_all('img'):
-        download_and_process_image(img, base_url, current_page_dir)
+    # 画像はまとめて並列に取得 (ホストごとの制限は fetcher が守る)
+    images = soup.find_all('img')
+    if images:
+        with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as pool:
+            list(pool.map(lambda img: download_and_process_image(img, base_url, current_page_dir), images))
 
-    process_and_translate_svgs(soup)
+    return soup, extracted_links
 
+def soup_to_md(soup):
     protected_tags = {}
     for i, table in enumerate(soup.find_all('table')):
         pid = f"__TABLE_PLACEHOLDER_{i}__"
@@ -272,7 +358,7 @@ def convert_to_hybrid_md(html_content, base_url):
     for pid, raw_html in protected_tags.items():
         markdown_content = markdown_content.replace(pid, raw_html)
 
-    return markdown_content, extracted_links
+    return markdown_content
 
 def clean_model_output(text):
     if not text: return ""
@@ -330,6 +416,12 @@ def translate_content(content, title):
     final_result = []
     
     for i, chunk in enumerate(chunks):
+        if translation_cache is not None:
+            cached = translation_cache.get('chunk', CONTENT_PROMPT_VERSION, chunk)
+            if cached is not None:
+                final_result.append(cached)
+                continue
+
         if len(chunks) > 1:
             print(f"    - パート {i+1}/{len(chunks)} を翻訳中...")
         
@@ -355,9 +447,11 @@ def translate_content(content, title):
         chunk_success = False
         for attempt in range(max_retries):
             try:
-                response = model.generate_content(prompt)
+                response = generate(model, prompt)
                 cleaned_text = clean_model_output(response.text)
                 final_result.append(cleaned_text)
+                if translation_cache is not None:
+                    translation_cache.put('chunk', CONTENT_PROMPT_VERSION, chunk, cleaned_text)
                 chunk_success = True
                 break
             except Exception as e:
@@ -375,6 +469,37 @@ def translate_content(content, title):
 
     return ''.join(final_result)
 
+def page_title(html_content):
+    m = re.search(r'<title[^>]*>(.*?)</title>', html_content, re.I | re.S)
+    return html.unescape(m.group(1).strip()) if m else ''
+
+def save_page_meta(url, html_content, links):
+    """ページのリンク一覧とメタデータを出力の横に保存する (再クロール時はこれを読むだけで済む)"""
+    base_path = get_save_path_base(url)
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    meta = {
+        'url': url,
+        'title': page_title(html_content),
+        'links': links,
+        'source_sha256': hashlib.sha256(html_content.encode('utf-8')).hexdigest(),
+        'saved_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    tmp_path = f"{base_path}{META_SUFFIX}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, f"{base_path}{META_SUFFIX}")
+
+def saved_links(url):
+    """翻訳済みで、リンク一覧も保存してあるページならそのリンクを返す (無ければ None)"""
+    base_path = get_save_path_base(url)
+    if not os.path.exists(f"{base_path}.html"):
+        return None
+    try:
+        with open(f"{base_path}{META_SUFFIX}", encoding='utf-8') as f:
+            return json.load(f)['links']
+    except (OSError, ValueError, KeyError):
+        return None
+
 def save_files(url, md_content, suffix=""):
     base_path = get_save_path_base(url)
     directory = os.path.dirname(base_path)
@@ -415,78 +540,127 @@ def save_files(url, md_content, suffix=""):
     label = "原文(EN)" if suffix else "翻訳(JP)"
     print(f"  -> {label}保存完了: {html_filename}")
 
-def process_url(url, is_recursive=False, visited=None):
-    if visited is not None and url in visited:
-        return [], False
+def process_pages(items):
+    """取得済みのページを変換・翻訳して保存する。新しく翻訳できたページ数を返す
 
-    base_path = get_save_path_base(url)
-    html_path = f"{base_path}.html"
-    
-    if os.path.exists(html_path):
-        print(f"\n[スキップ] 翻訳済み: {url}")
-        html = get_html(url)
-        if not html: return [], False
-        _, links = convert_to_hybrid_md(html, url)
-        if visited is not None: visited.add(url)
-        return links, False
-
-    print(f"\n[処理開始] {url}")
-    html = get_html(url)
-    if not html: return [], False
-
-    # 1. 英語のままMD化（画像DLやSVG翻訳はここに含まれる）
-    md_content_en, links = convert_to_hybrid_md(html, url)
-    
-    # 2. 原文保存
-    save_files(url, md_content_en, suffix="_en")
-    
-    # 3. 日本語へ翻訳
-    translated_md = translate_content(md_content_en, url)
-    
-    was_translated = False
-    if translated_md:
-        # 4. 翻訳文保存
+    SVGのテキストは渡された全ページ分を集めて重複を除き、まとめて翻訳する。
+    """
+    prepared = []
+    for url, html_content in items:
+        base_path = get_save_path_base(url)
+        if os.path.exists(f"{base_path}.html"):
+            # 以前のバージョンで翻訳したページ: リンク一覧だけ保存して、次回からは取得もしない
+            print(f"\n[スキップ] 翻訳済み: {url}")
+            save_page_meta(url, html_content, extract_links(html_content, url))
+            continue
+
+        print(f"\n[処理開始] {url}")
+        # 1. 不要な要素の削除、リンクの書き換え、画像のDL
+        soup, links = prepare_soup(html_content, url)
+        prepared.append((url, html_content, soup, links))
+
+    # 2. SVG画像内のテキストを全ページ分まとめて翻訳
+    translate_svg_nodes([node for _, _, soup, _ in prepared for node in svg_text_nodes(soup)])
+
+    translated_count = 0
+    for url, html_content, soup, links in prepared:
+        # 3. 英語のままMD化して原文保存
+        md_content_en = soup_to_md(soup)
+        save_files(url, md_content_en, suffix="_en")
+
+        # 4. 日本語へ翻訳
+        translated_md = translate_content(md_content_en, url)
+        if not translated_md:
+            continue
+
+        # 5. 翻訳文保存 (リンク一覧は翻訳が保存できた後に書く)
         save_files(url, translated_md, suffix="")
-        if visited is not None: visited.add(url)
-        was_translated = True
-    
-    return links, was_translated
+        save_page_meta(url, html_content, links)
+        translated_count += 1
+    return translated_count
 
 def main():
+    global fetcher, translation_cache
+
     parser = argparse.ArgumentParser(description='x86リファレンス 翻訳ツール (完成版)')
     parser.add_argument('url', type=str, help='開始URL')
     parser.add_argument('--limit', type=int, default=5, help='新規翻訳ページ数上限')
+    parser.add_argument('-j', '--jobs', type=int, default=site_crawler.WORKERS, help='ページ取得の並列数')
+    parser.add_argument('--per-host', type=int, default=site_crawler.PER_HOST, help='同じホストへの同時接続数')
+    parser.add_argument('--interval', type=float, default=site_crawler.INTERVAL, help='同じホストへのリクエスト間隔 (秒)')
+    parser.add_argument('--max-depth', type=int, default=None, help='開始URLから何リンク先までたどるか')
+    parser.add_argument('--prefer', metavar='REGEX', help='この正規表現に一致するURLを先に処理する')
+    parser.add_argument('--fresh', action='store_true', help='前回の続きから再開せず最初からクロールする')
+    parser.add_argument('--no-cache', action='store_true', help='翻訳キャッシュを使わない (結果も保存しない)')
+    parser.add_argument('--svg-batch-pages', type=int, default=1, help='SVGのテキストを何ページ分まとめて翻訳するか')
     args = parser.parse_args()
 
+    if not API_KEY:
+        print("エラー: 環境変数 GEMINI_API_KEY が設定されていません。")
+        sys.exit(1)
+    genai.configure(api_key=API_KEY)
+
     setup_css_file()
+    if not args.no_cache:
+        translation_cache = TranslationCache(os.path.join(OUTPUT_DIR, CACHE_FILENAME), MODEL_NAME)
 
-    start_url = args.url
     max_new_translations = args.limit
-    
-    visited = set()
-    queue = [start_url]
+    fetcher = Fetcher(per_host=args.per_host, interval=args.interval)
     new_translated_count = 0
 
-    while queue:
-        if max_new_translations > 0 and new_translated_count >= max_new_translations:
-            print("\n[Info] 上限に達したため終了します。")
-            break
+    # 待ち行列と処理済みURLは OUTPUT_DIR に保存し、中断しても次回はその続きから再開する
+    state_path = os.path.join(OUTPUT_DIR, STATE_FILENAME)
+    if args.fresh and os.path.exists(state_path):
+        os.remove(state_path)
+    priority = None
+    if args.prefer:
+        prefer = re.compile(args.prefer)
+        priority = lambda url, depth: (0 if prefer.search(url) else 1, depth)
+    frontier = Frontier(max_depth=args.max_depth, priority=priority, state_path=state_path)
+    if frontier.done:
+        print(f"[Info] 前回の続きから再開します (処理済み {len(frontier.done)} / 待ち {len(frontier)} ページ)")
+
+    # 取得とリンクの追跡はクローラーが並列に先読みし、翻訳はここで1ページずつ行う
+    # 何ページかまとめて処理するので、処理済みの記録はここで行う
+    crawler = Crawler(fetcher, extract_links, workers=args.jobs, frontier=frontier, known_links=saved_links,
+                      auto_done=False)
+    pages = crawler.crawl([args.url])
+    batch = []
+
+    def flush():
+        nonlocal new_translated_count
+        new_translated_count += process_pages(batch)
+        for url, _ in batch:
+            frontier.mark_done(url)
+        batch.clear()
+        print(f"  (進捗: {new_translated_count}/{max_new_translations})")
 
-        current_url = queue.pop(0)
-        current_url_clean = current_url.rstrip('/')
-        if any(v.rstrip('/') == current_url_clean for v in visited):
-            continue
+    try:
+        for url, html_content in pages:
+            if max_new_translations > 0 and new_translated_count >= max_new_translations:
+                print("\n[Info] 上限に達したため終了します。")
+                break
 
-        found_links, was_translated = process_url(current_url, visited=visited)
-        
-        if was_translated:
-            new_translated_count += 1
-            print(f"  (進捗: {new_translated_count}/{max_new_translations}) ...待機中(2秒)...")
-            time.sleep(2)
-        
-        for link in found_links:
-            if link not in queue and not any(v.rstrip('/') == link.rstrip('/') for v in visited):
-                queue.append(link)
+            batch.append((url, html_content))
+            # 上限を超えて翻訳しないように、残り枠より多くはまとめない
+            size = args.svg_batch_pages
+            if max_new_translations > 0:
+                size = min(size, max_new_translations - new_translated_count)
+            if len(batch) >= size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        pages.close()
+        fetcher.close()
+        if translation_cache is not None:
+            translation_cache.close()
+    print(f"\n[Info] HTTPリクエスト {fetcher.requests} 回 / {fetcher.bytes / 1e6:.1f} MB "
+          f"(保存済みのリンクを使って取得を省略: {crawler.skipped} ページ)")
+    if translation_cache is not None:
+        print(f"[Info] {translation_cache.summary()} / API呼び出し {api_calls} 回")
+    else:
+        print(f"[Info] API呼び出し {api_calls} 回")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,69 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+# 翻訳結果のキャッシュ (SQLite)
+# キーは 種類 + モデル名 + プロンプトのバージョン + 原文 のハッシュ。
+# モデルやプロンプトを変えたらバージョンを上げれば、古い結果は使われなくなる。
+
+
+class TranslationCache:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS translations (
+        key TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        result TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.executescript(self.SCHEMA)
+
+    def key(self, kind, prompt_version, source):
+        h = hashlib.sha256()
+        for part in (kind, self.model, str(prompt_version), source):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, kind, prompt_version, source):
+        """キャッシュにあれば翻訳結果、無ければ None"""
+        with self._lock:
+            row = self.con.execute("SELECT result FROM translations WHERE key = ?",
+                                   (self.key(kind, prompt_version, source),)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, kind, prompt_version, source, result):
+        self.put_many(kind, prompt_version, [(source, result)])
+
+    def put_many(self, kind, prompt_version, pairs):
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock, self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(self.key(kind, prompt_version, source), kind, self.model, prompt_version, source, result, now)
+                 for source, result in pairs])
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"翻訳キャッシュ: ヒット {self.hits} / ミス {self.misses} ({rate:.0f}%)"
+
+    def close(self):
+        with self._lock:
+            self.con.close()